@@ -0,0 +1,48 @@
+"""Compare the per-line parse_md_data path with the block-oriented mdout parser
+
+Usage: python benchmarks/bench_mdout_parser.py [size in MB]
+"""
+import os, sys, time, tempfile
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dashmd.utils import parse_md_data, max_workers
+from dashmd.mdout import MdoutReader
+from synthetic import write_mdout
+
+
+def per_line(path, parallel):
+    with open(path) as f:
+        lines = []
+        for line in f:
+            if "A V E R A G E S   O V E R" in line:
+                break
+            lines.append(line)
+    if parallel:
+        with ProcessPoolExecutor(max_workers=max_workers) as ex:
+            return sum(len(res["Nsteps"]) for res in ex.map(parse_md_data, lines))
+    return sum(len(parse_md_data(line)["Nsteps"]) for line in lines)
+
+
+def block(path):
+    data, _ = MdoutReader(path).read()
+    return len(data["Nsteps"])
+
+
+if __name__ == "__main__":
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prod.out")
+        write_mdout(path, size * 1024**2)
+        with open(path, "rb") as f:
+            n_lines = sum(1 for _ in f)
+        print(f"{os.path.getsize(path)/1024**2:.0f} MB, {n_lines} lines, {max_workers} workers")
+        benchmarks = [
+            ("parse_md_data (ProcessPoolExecutor)", lambda: per_line(path, True)),
+            ("parse_md_data (serial)", lambda: per_line(path, False)),
+            ("MdoutReader", lambda: block(path)),
+        ]
+        for name, func in benchmarks:
+            start = time.perf_counter()
+            n_records = func()
+            elapsed = time.perf_counter() - start
+            print(f"{name:<38} {n_records:>9d} records {elapsed:8.2f} s {n_lines/elapsed:>12,.0f} lines/s")
@@ -0,0 +1,77 @@
+"""Time the lookup of the last NSTEP record of large mdout files
+
+Usage: python benchmarks/bench_reverse_reader.py [size in GB] [directory]
+"""
+import os, re, sys, time, tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from dashmd.mdout import last_record
+from synthetic import write_mdout
+
+
+def readlines_reverse(filename, blocksize=64*1024):
+    """Reads a file from end to begining, by blocks of `blocksize` bytes (superseded by last_record)"""
+    with open(filename, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            size = min(blocksize, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            # the first line might start in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode(errors="replace")
+        yield remainder.decode(errors="replace")
+
+
+def readlines_reverse_char(filename):
+    """Previous implementation, reading one character at a time"""
+    with open(filename) as qfile:
+        qfile.seek(0, os.SEEK_END)
+        position = qfile.tell()
+        line = ''
+        while position >= 0:
+            qfile.seek(position)
+            next_char = qfile.read(1)
+            if next_char == "\n":
+                yield line[::-1]
+                line = ''
+            else:
+                line += next_char
+            position -= 1
+        yield line[::-1]
+
+
+def last_nstep(reader, path):
+    for i, line in enumerate(reader(path)):
+        re1 = re.search(r"NSTEP =\s*(\d+)", line)
+        if re1:
+            return int(re1.group(1))
+        if i > 150:
+            return None
+
+
+def timeit(func, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - start) / repeat, result
+
+
+if __name__ == "__main__":
+    size = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    with tempfile.TemporaryDirectory(dir=sys.argv[2] if len(sys.argv) > 2 else None) as tmp:
+        for footer in (True, False):
+            path = os.path.join(tmp, "prod.out")
+            write_mdout(path, size * 1024**3, footer=footer)
+            print(f"{os.path.getsize(path)/1024**3:.2f} GB mdout, {'finished' if footer else 'running'} simulation")
+            benchmarks = [
+                ("last NSTEP, char-by-char reader", lambda: last_nstep(readlines_reverse_char, path)),
+                ("last NSTEP, block reader", lambda: last_nstep(readlines_reverse, path)),
+                ("last_record", lambda: last_record(path)),
+            ]
+            for name, func in benchmarks:
+                elapsed, result = timeit(func)
+                print(f"  {name:<34} {elapsed*1e3:10.3f} ms  {result}")
+            os.remove(path)
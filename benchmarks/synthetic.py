@@ -0,0 +1,93 @@
+"""Write synthetic Amber mdout files for the benchmarks"""
+import random
+
+MD_HEADER = """
+          -------------------------------------------------------
+          Amber 18 PMEMD                              2018
+          -------------------------------------------------------
+
+| Run on 01/01/2020 at 00:00:00
+
+|   MDIN: prod.in
+|  MDOUT: prod.out
+| INPCRD: heat.rst7
+|   PARM: system.prmtop
+| RESTRT: prod.rst7
+|   REFC: refc
+|  MDVEL: mdvel
+|   MDEN: mden
+|  MDCRD: prod.nc
+| MDINFO: mdinfo
+
+ Here is the input file:
+
+ &cntrl
+  imin=0, irest=1, ntx=5,
+  nstlim=250000000, dt=0.002,
+  ntpr=5000, ntwx=5000, ntwr=5000,
+ /
+
+--------------------------------------------------------------------------------
+   4.  RESULTS
+--------------------------------------------------------------------------------
+
+"""
+
+MD_RECORD = """ NSTEP = {nstep:>8d}   TIME(PS) = {time:>11.3f}  TEMP(K) = {temp:>8.2f}  PRESS = {press:>7.1f}
+ Etot   = {etot:>14.4f}  EKtot   = {ektot:>14.4f}  EPtot      = {eptot:>14.4f}
+ BOND   =      1234.5678  ANGLE   =      3456.7890  DIHED      =      4567.8901
+ 1-4 NB =      1234.5678  1-4 EEL =     12345.6789  VDWAALS    =     34567.8901
+ EELEC  =   -345678.9012  EHBOND  =         0.0000  RESTRAINT  =         0.0000
+ EKCMT  =     23456.7890  VIRIAL  =     23789.0123  VOLUME     = {volume:>14.4f}
+                                                    Density    = {density:>14.4f}
+ ------------------------------------------------------------------------------
+
+"""
+
+MD_FOOTER = """
+      A V E R A G E S   O V E R    1000 S T E P S
+
+
+ NSTEP =  5000000   TIME(PS) =   10000.000  TEMP(K) =   300.00  PRESS =     0.0
+"""
+
+MIN_HEADER = MD_HEADER.replace("imin=0", "imin=1")
+
+MIN_RECORD = """
+
+   NSTEP       ENERGY          RMS            GMAX         NAME    NUMBER
+ {nstep:>6d}      {etot:>11.4E}     1.2345E-01     1.2345E+01     C1       1234
+
+ BOND    =     1234.5678  ANGLE   =     2345.6789  DIHED      =     3456.7890
+ VDWAALS =    34567.8901  EEL     =  -345678.9012  HBOND      =        0.0000
+ 1-4 VDW =     1234.5678  1-4 EEL =    12345.6789  RESTRAINT  =        0.0000
+"""
+
+
+def md_record(nstep, dt=0.002):
+    return MD_RECORD.format(
+        nstep=nstep, time=nstep * dt,
+        temp=random.gauss(300, 2), press=random.gauss(0, 100),
+        etot=random.gauss(-234567, 100), ektot=random.gauss(56789, 100), eptot=random.gauss(-291356, 100),
+        volume=random.gauss(987654, 100), density=random.gauss(1.01, 0.01),
+    )
+
+
+def write_mdout(path, size, is_min=False, ntpr=5000, footer=True):
+    """Write a mdout file of at least `size` bytes, returns the number of records"""
+    random.seed(42)
+    # the same block of records is repeated to speed up the generation of large files
+    block = "".join(md_record(i * ntpr) for i in range(1, 1001))
+    if is_min:
+        block = "".join(MIN_RECORD.format(nstep=i * 10, etot=random.gauss(-1.2e5, 100)) for i in range(1, 1001))
+    n_records = 0
+    with open(path, "w") as f:
+        f.write(MIN_HEADER if is_min else MD_HEADER)
+        written = 0
+        while written < size:
+            f.write(block)
+            written += len(block)
+            n_records += 1000
+        if footer and not is_min:
+            f.write(MD_FOOTER)
+    return n_records
@@ -0,0 +1,484 @@
+import os, logging
+from collections import OrderedDict
+from functools import reduce
+from multiprocessing import cpu_count, get_context
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pytraj as pt
+from .cache import cache_file, save_array, load_array
+from .topology import load_topology, atom_indices
+
+log = logging.getLogger("dashmd")
+
+# number of frames loaded in memory at once, and computed by each task of the pool
+CHUNK_FRAMES = 500
+max_workers = cpu_count()
+# worker processes kept between calculations, created on first use
+pool = None
+# residues selected by the "protein" keyword of the masks
+PROTEIN_RESIDUES = [
+    "ALA", "ARG", "ASH", "ASN", "ASP", "CYM", "CYS", "CYX", "GLH", "GLN", "GLU", "GLY", "HID", "HIE",
+    "HIP", "HYP", "HIS", "ILE", "LEU", "LYN", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL",
+]
+
+
+def expand_mask(mask):
+    """Replace the protein keyword of a mask by the list of protein residues"""
+    return mask.replace("protein", ":" + ",".join(PROTEIN_RESIDUES))
+
+
+def indices_to_mask(indices):
+    """Convert sorted atom indices (starting at 0) to a mask of atom numbers, such as @1-10,15"""
+    indices = np.asarray(indices)
+    # start and end of each range of consecutive indices
+    breaks = np.flatnonzero(np.diff(indices) != 1)
+    starts = np.r_[indices[0], indices[breaks + 1]] + 1
+    ends = np.r_[indices[breaks], indices[-1]] + 1
+    return "@" + ",".join(str(s) if s == e else f"{s}-{e}" for s, e in zip(starts, ends))
+
+
+def rmsd(coords, ref):
+    """Best-fit RMSD (Kabsch, without mass weighting) between each frame of coords (n_frames, n_atoms, 3)
+    and the reference coordinates (n_atoms, 3)"""
+    coords = coords - coords.mean(axis=1, keepdims=True)
+    ref = ref - ref.mean(axis=0)
+    # singular values of the covariance matrices give the optimal rotation
+    u, s, vt = np.linalg.svd(np.einsum("fai,aj->fij", coords, ref))
+    # avoid reflections
+    s[:, -1] *= np.sign(np.linalg.det(u) * np.linalg.det(vt))
+    msd = ((coords ** 2).sum(axis=(1, 2)) + (ref ** 2).sum() - 2 * s.sum(axis=1)) / ref.shape[0]
+    return np.sqrt(np.maximum(msd, 0))
+
+
+def superpose(coords, ref):
+    """Best-fit superposition (Kabsch) of each frame of coords (n_frames, n_atoms, 3) on the centered
+    reference coordinates (n_atoms, 3)"""
+    coords = coords - coords.mean(axis=1, keepdims=True)
+    ref = ref - ref.mean(axis=0)
+    u, _, vt = np.linalg.svd(np.einsum("fai,aj->fij", coords, ref))
+    # avoid reflections
+    u[:, :, -1] *= np.sign(np.linalg.det(u) * np.linalg.det(vt))[:, None]
+    return np.einsum("fai,fij->faj", coords, u @ vt)
+
+
+def iterchunks(traj, mask, step=1, start=0, stop=None, chunksize=CHUNK_FRAMES):
+    """Iterate over the frames of a pytraj trajectory by chunks of `chunksize` frames.
+    Yields the times (n_frames,) and coordinates (n_frames, n_atoms, 3) of the atoms in the mask"""
+    times, coords = [], []
+    for frame in traj.iterframe(start=start, stop=stop, step=step, autoimage=True, rmsfit=False, mask=mask):
+        times.append(frame.time)
+        # the frame can be reused by pytraj
+        coords.append(np.array(frame.xyz))
+        if len(coords) == chunksize:
+            yield np.array(times), np.array(coords)
+            times, coords = [], []
+    if coords:
+        yield np.array(times), np.array(coords)
+
+
+class Analysis:
+    """Base class of the trajectory analyses. The analyses of a calculation share the same pass on
+    the trajectories: each one selects its atoms, and computes a state (dictionary of arrays) on the
+    coordinates of these atoms for each chunk of frames. The states of consecutive chunks are merged,
+    which allows computing them in parallel and incrementally"""
+    # name of the analysis, used as key of the registry
+    name = None
+    # True if the analysis gives one value per frame, which can be streamed to the plots
+    time_series = True
+
+    def __init__(self, mask):
+        self.mask = mask
+        # positions of the atoms of the analysis in the coordinates read for all the analyses
+        self.positions = None
+
+
+    def key(self):
+        """Parameters identifying the results of the analysis"""
+        return (self.name, self.mask)
+
+
+    def atoms(self, topology):
+        """Sorted indices of the atoms of a topology file needed by the analysis"""
+        return atom_indices(topology, expand_mask(self.mask))
+
+
+    def empty(self):
+        """State of the analysis before reading any frame"""
+        raise NotImplementedError
+
+
+    def compute(self, times, coords, ref):
+        """Returns the state computed on a chunk of frames (coords and ref only contain the atoms of the analysis)"""
+        raise NotImplementedError
+
+
+    def merge(self, state, other):
+        """Merge the states computed on consecutive frames"""
+        return {key: np.concatenate([state[key], other[key]]) for key in state}
+
+
+    def decimate(self, state, factor):
+        """Only keep one frame out of `factor` in the state"""
+        return {key: value[::factor] for key, value in state.items()}
+
+
+    def results(self, state):
+        """Returns the columns displayed on the plot"""
+        return state
+
+
+class Rmsd(Analysis):
+    """RMSD to the first frame"""
+    name = "RMSD"
+
+    def empty(self):
+        return {"Time": np.empty(0), "RMSD": np.empty(0)}
+
+
+    def compute(self, times, coords, ref):
+        return {"Time": times, "RMSD": rmsd(coords, ref)}
+
+
+class RadiusOfGyration(Analysis):
+    """Radius of gyration (without mass weighting)"""
+    name = "Radius of gyration"
+
+    def empty(self):
+        return {"Time": np.empty(0), "Rg": np.empty(0)}
+
+
+    def compute(self, times, coords, ref):
+        centered = coords - coords.mean(axis=1, keepdims=True)
+        return {"Time": times, "Rg": np.sqrt((centered ** 2).sum(axis=2).mean(axis=1))}
+
+
+class Rmsf(Analysis):
+    """RMSF of each residue (average of the RMSF of its atoms), after superposition on the first frame"""
+    name = "RMSF"
+    time_series = False
+
+    def atoms(self, topology):
+        indices = super().atoms(topology)
+        top = load_topology(topology)
+        # residue of each atom, and number and name of the residues
+        self.residues = np.array([top.atom(i).resid for i in indices])
+        residues = np.unique(self.residues)
+        self.residue_ids = residues + 1
+        self.residue_names = [top.residue(i).name for i in residues]
+        return indices
+
+
+    def empty(self):
+        n = len(self.residues)
+        # number of frames, sums of the positions and of their squared norms
+        return {"n": np.zeros(1), "sum": np.zeros((n, 3)), "sum2": np.zeros(n)}
+
+
+    def compute(self, times, coords, ref):
+        fitted = superpose(coords, ref)
+        return {"n": np.array([len(fitted)]), "sum": fitted.sum(axis=0), "sum2": (fitted ** 2).sum(axis=(0, 2))}
+
+
+    def merge(self, state, other):
+        return {key: state[key] + other[key] for key in state}
+
+
+    def decimate(self, state, factor):
+        # statistics computed on more frames are kept
+        return state
+
+
+    def results(self, state):
+        n = state["n"][0]
+        if not n:
+            return {"Residue": np.empty(0), "Name": [], "RMSF": np.empty(0)}
+        variance = state["sum2"] / n - ((state["sum"] / n) ** 2).sum(axis=1)
+        rmsf = np.sqrt(np.maximum(variance, 0))
+        # average over the atoms of each residue
+        _, residues = np.unique(self.residues, return_inverse=True)
+        return {
+            "Residue": self.residue_ids,
+            "Name": self.residue_names,
+            "RMSF": np.bincount(residues, weights=rmsf) / np.bincount(residues),
+        }
+
+
+class Distances(Analysis):
+    """Distances between the centers of geometry of pairs of masks, written as `mask1 mask2; mask3 mask4`"""
+    name = "Distances"
+
+    def __init__(self, mask):
+        super().__init__(mask)
+        self.pairs = [pair.split() for pair in mask.split(";") if pair.strip()]
+        if not self.pairs:
+            raise ValueError("No pair of masks given for the distances")
+        for pair in self.pairs:
+            if len(pair) != 2:
+                raise ValueError(f"Distances must be given as pairs of masks, not {' '.join(pair)!r}")
+        self.columns = [f"d{i+1}" for i in range(len(self.pairs))]
+
+
+    def atoms(self, topology):
+        groups = [atom_indices(topology, expand_mask(m)) for pair in self.pairs for m in pair]
+        for group, m in zip(groups, (m for pair in self.pairs for m in pair)):
+            if not len(group):
+                raise ValueError(f"No atom selected by {m!r}")
+        indices = np.unique(np.concatenate(groups))
+        # positions of the atoms of each mask in the coordinates of the analysis
+        self.groups = [np.searchsorted(indices, group) for group in groups]
+        return indices
+
+
+    def empty(self):
+        return {"Time": np.empty(0), **{column: np.empty(0) for column in self.columns}}
+
+
+    def compute(self, times, coords, ref):
+        centers = [coords[:, group].mean(axis=1) for group in self.groups]
+        state = {"Time": times}
+        for column, first, second in zip(self.columns, centers[::2], centers[1::2]):
+            state[column] = np.linalg.norm(first - second, axis=1)
+        return state
+
+
+# analyses available in the dashboard, new ones can be added with register_analysis
+ANALYSES = OrderedDict()
+
+
+def register_analysis(analysis_class):
+    """Make an analysis available in the dashboard"""
+    ANALYSES[analysis_class.name] = analysis_class
+    return analysis_class
+
+
+for analysis_class in (Rmsd, Rmsf, RadiusOfGyration, Distances):
+    register_analysis(analysis_class)
+
+
+def get_pool():
+    """Returns the pool of worker processes used for the analyses"""
+    global pool
+    if pool is None:
+        # workers are spawned since the server runs several threads
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+    return pool
+
+
+def analysis_task(path, topology, start, stop, step, mask, analyses, ref):
+    """Compute the analyses on the frames start:stop:step of a trajectory file, reading the atoms of
+    the mask once for all the analyses. Runs in a worker process, returns the state of each analysis"""
+    # each worker process keeps its own cache of topologies
+    top = load_topology(topology)
+    traj = pt.iterload(path, top)
+    states = [analysis.empty() for analysis in analyses]
+    for times, coords in iterchunks(traj, mask, step=step, start=start, stop=stop):
+        states = [
+            analysis.merge(state, analysis.compute(times, coords[:, analysis.positions], ref[analysis.positions]))
+            for analysis, state in zip(analyses, states)
+        ]
+    return states
+
+
+def trajectory_entry(analyses):
+    """State of the calculation for one trajectory file"""
+    return {
+        # inode and size of the file at the last calculation
+        "inode": None, "size": 0,
+        # index of the next frame to read
+        "next": 0,
+        "states": [analysis.empty() for analysis in analyses],
+    }
+
+
+class TrajectoryAnalysis:
+    """Analyses of a set of trajectories, computed in one pass and only on the frames added since the
+    previous calculation. The last frame read in each file and the results are saved in the cache"""
+    def __init__(self, topology, trajectories, analyses):
+        self.topology = topology
+        self.trajectories = list(trajectories)
+        self.analyses = analyses
+        # the results are computed again if the topology is edited
+        self.topology_mtime = os.stat(topology).st_mtime_ns
+        self.cache_name = cache_file(
+            "analysis", os.path.realpath(topology), self.topology_mtime, [os.path.realpath(f) for f in trajectories],
+            [analysis.key() for analysis in analyses])
+        # atoms read for all the analyses
+        atoms = [np.asarray(analysis.atoms(topology)) for analysis in analyses]
+        for analysis, analysis_atoms in zip(analyses, atoms):
+            if not len(analysis_atoms):
+                raise ValueError(f"No atom selected by {analysis.mask!r} for the {analysis.name}")
+        indices = np.unique(np.concatenate(atoms))
+        self.mask = indices_to_mask(indices)
+        for analysis, analysis_atoms in zip(analyses, atoms):
+            analysis.positions = np.searchsorted(indices, analysis_atoms)
+        self.reset()
+
+
+    def key(self):
+        """Parameters identifying the calculation"""
+        return (self.topology, self.trajectories, [analysis.key() for analysis in self.analyses])
+
+
+    def matches(self, topology, trajectories, analyses):
+        """True if the calculation is for these files and analyses, and the topology was not modified since"""
+        return (
+            (self.key() == (topology, list(trajectories), [analysis.key() for analysis in analyses]))
+            and (os.stat(topology).st_mtime_ns == self.topology_mtime)
+        )
+
+
+    def reset(self):
+        """Forget everything that was computed"""
+        # only every `stride` frame of each file is used
+        self.stride = None
+        self.ref = None
+        self.files = OrderedDict((path, trajectory_entry(self.analyses)) for path in self.trajectories)
+
+
+    def results(self, index):
+        """Results of an analysis on all the frames computed"""
+        analysis = self.analyses[index]
+        state = reduce(analysis.merge, [f["states"][index] for f in self.files.values()])
+        return analysis.results(state)
+
+
+    def load_cache(self):
+        """Restore the results of a previous calculation. Returns True if the cache could be used"""
+        meta, data = load_array(self.cache_name)
+        if (meta is None) or ([f["path"] for f in meta["files"]] != self.trajectories):
+            return False
+        log.debug(f"Restoring the analyses of {self.trajectories} from the cache")
+        self.reset()
+        self.stride = meta["stride"]
+        for entry in meta["files"]:
+            self.files[entry["path"]].update(inode=entry["inode"], size=entry["size"], next=entry["next"])
+        # the arrays of the states are saved one after the other
+        position = 0
+        for path, index, key, shape in meta["arrays"]:
+            size = int(np.prod(shape))
+            self.files[path]["states"][index][key] = np.array(data[position:position + size]).reshape(shape)
+            position += size
+        return True
+
+
+    def save_cache(self):
+        """Save the results computed so far"""
+        arrays, layout = [], []
+        for path, f in self.files.items():
+            for index, state in enumerate(f["states"]):
+                for key, value in state.items():
+                    arrays.append(np.ravel(value))
+                    layout.append([path, index, key, list(np.shape(value))])
+        try:
+            save_array(self.cache_name, np.concatenate(arrays).astype(float), {
+                "stride": self.stride,
+                "files": [
+                    {"path": path, "inode": f["inode"], "size": f["size"], "next": f["next"]}
+                    for path, f in self.files.items()
+                ],
+                "arrays": layout,
+            })
+        except OSError as e:
+            log.warning(f"Could not save the analyses of {self.trajectories} to the cache: {e}")
+
+
+    def outdated(self):
+        """True if a trajectory (or the topology) was modified since the last calculation"""
+        if os.stat(self.topology).st_mtime_ns != self.topology_mtime:
+            return True
+        for path, f in self.files.items():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if (stat.st_ino != f["inode"]) or (stat.st_size != f["size"]):
+                return True
+        return False
+
+
+    def set_stride(self, stride):
+        """Use a stride of at least `stride` frames. It is kept a multiple of the previous stride
+        so that the values already computed can be downsampled instead of recomputed"""
+        if self.stride is None:
+            self.stride = stride
+            return
+        factor = max(1, stride // self.stride)
+        if factor == 1:
+            return
+        log.debug(f"Increasing the stride of the analyses from {self.stride} to {self.stride * factor}")
+        self.stride *= factor
+        for f in self.files.values():
+            f["states"] = [analysis.decimate(state, factor) for analysis, state in zip(self.analyses, f["states"])]
+            f["next"] = -(-f["next"] // self.stride) * self.stride
+
+
+    def update(self, stride):
+        """Compute the analyses on the frames added since the last calculation, by chunks.
+        Yields a list with the name of each analysis, its results, and True if they are new values to
+        append to the previous ones or False if they replace all the results"""
+        # rewritten trajectories are read again from the start
+        for i, (path, f) in enumerate(self.files.items()):
+            stat = os.stat(path)
+            if (f["inode"] is not None) and ((stat.st_ino != f["inode"]) or (stat.st_size < f["size"])):
+                log.debug(f"{path} was rewritten, computing its analyses from the start")
+                if i == 0:
+                    # the reference has changed
+                    self.reset()
+                    break
+                self.files[path] = trajectory_entry(self.analyses)
+        self.set_stride(stride)
+        yield [(analysis.name, self.results(i), False) for i, analysis in enumerate(self.analyses)]
+        top = load_topology(self.topology)
+        if self.ref is None:
+            _, coords = next(iterchunks(pt.iterload(self.trajectories[0], top), self.mask, chunksize=1))
+            self.ref = coords[0]
+        # the new frames of all the files are split in ranges computed in parallel
+        tasks = []
+        # size of each file, only recorded once all its new frames are computed, and its remaining tasks
+        sizes, remaining = {}, {}
+        executor = get_pool()
+        try:
+            for path, f in self.files.items():
+                stat = os.stat(path)
+                n_frames = pt.iterload(path, top).n_frames
+                sizes[path] = (stat.st_ino, stat.st_size)
+                remaining[path] = len(range(f["next"], n_frames, CHUNK_FRAMES * self.stride))
+                if not remaining[path]:
+                    f["inode"], f["size"] = sizes[path]
+                if n_frames > f["next"]:
+                    log.debug(f"Analysing {path} from frame {f['next']} with a step of {self.stride}")
+                for start in range(f["next"], n_frames, CHUNK_FRAMES * self.stride):
+                    stop = min(start + CHUNK_FRAMES * self.stride, n_frames)
+                    job = executor.submit(
+                        analysis_task, path, self.topology, start, stop, self.stride, self.mask, self.analyses, self.ref)
+                    tasks.append((path, start, stop, job))
+            paths = list(self.files)
+            for path, start, stop, job in tasks:
+                states = job.result()
+                f = self.files[path]
+                f["states"] = [
+                    analysis.merge(state, new) for analysis, state, new in zip(self.analyses, f["states"], states)
+                ]
+                f["next"] = start + -(-(stop - start) // self.stride) * self.stride
+                remaining[path] -= 1
+                if not remaining[path]:
+                    f["inode"], f["size"] = sizes[path]
+                self.save_cache()
+                # new values are only at the end if the next trajectories have no results yet
+                at_end = not any(self.files[p]["next"] for p in paths[paths.index(path)+1:])
+                updates = []
+                for i, (analysis, state) in enumerate(zip(self.analyses, states)):
+                    if analysis.time_series and at_end:
+                        updates.append((analysis.name, analysis.results(state), True))
+                    else:
+                        updates.append((analysis.name, self.results(i), False))
+                yield updates
+        except BrokenProcessPool:
+            global pool
+            pool = None
+            raise
+        finally:
+            for *_, job in tasks:
+                job.cancel()
+        self.save_cache()
@@ -2,18 +2,24 @@ import logging, os
 from bokeh.models.widgets import Tabs, Panel
 from bokeh.layouts import row, column, grid
 from .dashboard import Dashboard
+from .overview import FleetOverview
 
 log = logging.getLogger("dashmd")
 
 
-def create_app(doc, default_dir="./", update=10, port=5100):
+def create_app(doc, default_dir="./", update=10, port=5100, window=100, watch=False, retention=10000, history=2000,
+    fleet=None, fleet_rate=50):
     """Creates a Bokeh document that the server will display"""
     # start loading the dashboard
     log.debug(f"Creating Bokeh app")
     log.debug(f"Default directory: {os.path.realpath(default_dir)}")
     log.debug(f"Update rate for the dashboard: {update} seconds")
+    log.debug(f"Watch for file changes: {watch}")
+    log.debug(f"Moving average window: {window} points")
+    log.debug(f"Retention of the live plots: {retention} points, and {history} points for the older data")
     doc.title = "DashMD"
-    document = Dashboard(default_dir, port)
+    document = Dashboard(doc, default_dir, port, avg_window=window, retention=retention, history=history)
+    overview = FleetOverview(doc, update=update, rate=fleet_rate, root=fleet)
 
     if os.path.exists(os.path.join(document.md_dir.value, "mdinfo")):
         document.anim_button.button_type = "success"
@@ -23,20 +29,20 @@ def create_app(doc, default_dir="./", update=10, port=5100):
             document.anim_button.label = "◼ Stop"
             document.anim_button.button_type = "danger"
             document.autocomp_results.children = []
-            # first update of the dashboard
-            document.get_mdout_files()
-            document.parse_mdinfo()
-            for mdout in document.mdout_files[:document.slider.value]:
-                document.read_mdout_header(mdout)
-            document.display_simulations_length()
-            document.view_structure()
-            document.mdinfo_callback = doc.add_periodic_callback(document.update_dashboard, update*1e3)
+            # the files are read once for all the sessions watching the same directory
+            document.start_monitoring(update, watch)
         else:
             document.anim_button.label = "▶ Load"
             document.anim_button.button_type = "success"
-            doc.remove_periodic_callback(document.mdinfo_callback)
+            document.stop_monitoring()
     document.anim_button.on_click(callback_load_dir)
 
+    def callback_session_destroyed(session_context):
+        log.debug("Session closed")
+        document.stop_monitoring()
+        overview.stop()
+    doc.on_session_destroyed(callback_session_destroyed)
+
     # arrange display with tabs
     dashboard = Panel(
         title="Dashboard",
@@ -56,7 +62,7 @@ def create_app(doc, default_dir="./", update=10, port=5100):
             ]),
         ]),
         row([document.bar]),
-        row([document.mdout_sel, document.mdout_button]),
+        row([document.mdout_sel, document.mdout_button, document.run_toggle, document.run_sel]),
         ], sizing_mode="scale_both")
     )
     temp_tab = Panel(title="Temperature", child=document.temperature_fig)
@@ -64,16 +70,28 @@ def create_app(doc, default_dir="./", update=10, port=5100):
     e_tab = Panel(title="Energy", child=document.energy_fig)
     vol_tab = Panel(title="Volume", child=document.vol_fig)
     dens_tab = Panel(title="Density", child=document.density_fig)
-    rmsd_tab = Panel(title="RMSD", child=grid([column([
-        row([document.topology, document.trajectory, column(document.mask, document.rmsd_button)]),
-        document.rmsd_fig,
+    analysis_tab = Panel(title="Analysis", child=grid([column([
+        row([document.topology, document.trajectory, column(document.mask, document.analysis_button)]),
+        row([document.analysis_sel, document.distances, document.analysis_error]),
+        Tabs(tabs=[
+            Panel(title="RMSD", child=document.rmsd_fig),
+            Panel(title="RMSF", child=document.rmsf_fig),
+            Panel(title="Radius of gyration", child=document.rg_fig),
+            Panel(title="Distances", child=document.distances_fig),
+        ]),
     ])]))
     view_tab = Panel(title="View", child=grid([
         column([
             row([document.topology, document.rst_traj, document.view_button, document.ngl_help_button]),
             row([document.view_canvas, document.ngl_help_div]),
-            row([document.ngl_lig, document.ngl_representations]),
+            row([document.ngl_lig, document.ngl_shell, document.ngl_representations]),
+            row([document.trajectory, column(document.frames_button, document.play_button), document.frame_slider]),
         ])
     ]))
-    tabs = Tabs(tabs=[ dashboard, view_tab, rmsd_tab, temp_tab, press_tab, e_tab, vol_tab, dens_tab])
+    fleet_tab = Panel(title="Fleet", child=grid([column([
+        row([overview.root, overview.scan_button]),
+        overview.status,
+        overview.table,
+    ])]))
+    tabs = Tabs(tabs=[ dashboard, view_tab, analysis_tab, temp_tab, press_tab, e_tab, vol_tab, dens_tab, fleet_tab])
     doc.add_root(tabs)
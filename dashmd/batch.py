@@ -0,0 +1,230 @@
+import os, glob, logging
+from itertools import groupby
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from .mdout import MdoutReader, MdoutRun, MdoutInfo, MdinfoReader, chunk_bounds, parse_chunk, to_columns
+from .directory import DirectorySnapshot
+from .fleet import find_md_dirs, progress_row, local_time
+
+log = logging.getLogger("dashmd")
+
+# formats of the exported files
+FORMATS = ["csv", "parquet", "npz"]
+# columns of the summary, with their title and format in the text table
+SUMMARY_COLUMNS = [
+    ("directory", "Directory", "{}"),
+    ("simulations", "MD files", "{:d}"),
+    ("ns", "ns", "{:.2f}"),
+    ("progress", "Progress (%)", "{:.1f}"),
+    ("speed", "ns/day", "{:.2f}"),
+    ("time_left", "Time remaining", "{}"),
+    ("update_time", "Last update", "{}"),
+    ("temperature", "Temperature (K)", "{:.1f}"),
+]
+# default mask of the RMSD, same as the Analysis tab
+RMSD_MASK = "protein@CA,C,O,N"
+
+
+def md_directories(paths, recursive=False):
+    """Returns the directories (or directories matching globs) of a list, or the directories containing a
+    mdinfo file below them if `recursive` is True"""
+    md_dirs = []
+    for path in paths:
+        if recursive:
+            md_dirs.extend(find_md_dirs(path))
+        else:
+            md_dirs.extend(p for p in sorted(glob.glob(path)) if os.path.isdir(p))
+    # without duplicates
+    return list(dict.fromkeys(md_dirs))
+
+
+def output_names(md_dirs):
+    """Returns the name of the output directory of each MD directory, relative to their common parent"""
+    paths = [os.path.abspath(path) for path in md_dirs]
+    if len(paths) < 2:
+        return [os.path.basename(path) for path in paths]
+    common = os.path.commonpath(paths)
+    return [os.path.relpath(path, common) if path != common else os.path.basename(path) for path in paths]
+
+
+def check_format(fmt):
+    """Raises an error if the tables cannot be written in this format"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError("Writing Parquet files requires pyarrow, install it with `pip install pyarrow`") from None
+
+
+def write_table(columns, path, fmt="csv"):
+    """Write a dictionary of columns to a CSV, Parquet or NPZ file. `path` has no extension.
+    Returns the name of the file"""
+    check_format(fmt)
+    name = f"{path}.{fmt}"
+    os.makedirs(os.path.dirname(name) or ".", exist_ok=True)
+    if fmt == "npz":
+        np.savez_compressed(name, **columns)
+    else:
+        import pandas as pd
+        df = pd.DataFrame(columns)
+        if fmt == "csv":
+            df.to_csv(name, index=False)
+        else:
+            df.to_parquet(name, index=False)
+    log.debug(f"Wrote {name}")
+    return name
+
+
+def read_mdout_files(paths, jobs=1, info=None):
+    """Parse mdout files by chunks of CHUNK_SIZE bytes, the chunks of all the files being parsed in parallel
+    by `jobs` processes. Yields each path and its records (array with one row per MDOUT_KEYS), in the order
+    of the paths. The records saved in the cache by the dashboard are not parsed again"""
+    info = info or MdoutInfo()
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        tasks = []
+        for path in paths:
+            is_min = bool(info.get(path).get("min"))
+            reader = MdoutReader(path, is_min)
+            reader.load_cache()
+            size = os.path.getsize(path)
+            if reader.finished or (reader.offset >= size):
+                bounds = []
+            else:
+                bounds = chunk_bounds(path, reader.offset, size, is_min)
+            # the last record is still being written if the simulation is running
+            jobs_ = [
+                ex.submit(parse_chunk, path, start, stop, is_min, stop == size)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            tasks.append((path, reader.data, jobs_))
+        for path, cached, jobs_ in tasks:
+            results = [cached]
+            for job in jobs_:
+                data, finished = job.result()
+                results.append(data.T)
+                if finished:
+                    break
+            for job in jobs_:
+                job.cancel()
+            log.debug(f"Parsed {sum(r.shape[1] for r in results)} records of {path}")
+            yield path, np.concatenate(results, axis=1)
+
+
+def stitch_run(segments, info):
+    """Returns the records of consecutive MD simulations (path and records of each one, in chronological
+    order) on a continuous time axis, as a dictionary of columns"""
+    readers = []
+    for path, data in segments:
+        reader = MdoutReader(path)
+        reader.append(data)
+        readers.append(reader)
+    run = MdoutRun(readers, [info.get(path).get("dt", 0.002) for path, _ in segments])
+    run.stitch()
+    return run.columns()
+
+
+def compute_rmsd(snapshot, topology=None, mask=RMSD_MASK, stride=1):
+    """Returns the RMSD to the first frame of the trajectories of a MD directory (in chronological order)
+    as a dictionary of columns, or None if there's no topology or trajectory"""
+    # pytraj is only needed for the analyses
+    from .analysis import TrajectoryAnalysis, ANALYSES
+    topology = topology or (snapshot.topologies[0] if snapshot.topologies else None)
+    # trajectories that were just created have no frame yet
+    trajectories = [
+        os.path.join(snapshot.path, f) for f in reversed(snapshot.trajectories) if snapshot.stat(f).st_size
+    ]
+    if (topology is None) or (not trajectories):
+        log.warning(f"No topology or trajectory to compute the RMSD in {snapshot.path}")
+        return None
+    calc = TrajectoryAnalysis(os.path.join(snapshot.path, topology), trajectories, [ANALYSES["RMSD"](mask)])
+    # shares the results computed by the dashboard
+    calc.load_cache()
+    for _ in calc.update(stride):
+        pass
+    return calc.results(0)
+
+
+def export(md_dirs, output, fmt="csv", jobs=1, run=False, rmsd=False, topology=None, mask=RMSD_MASK, stride=1):
+    """Export the records of each mdout file of the MD directories (and optionally the whole run and the RMSD)
+    to one file per table, in one sub-directory of `output` per MD directory. Returns the names of the files"""
+    check_format(fmt)
+    snapshots = [DirectorySnapshot(path) for path in md_dirs]
+    names = output_names(md_dirs)
+    info = MdoutInfo()
+    # mdout files of all the directories, in chronological order
+    files = [(i, os.path.join(s.path, f)) for i, s in enumerate(snapshots) for f in reversed(s.mdout)]
+    parsed = zip((i for i, _ in files), read_mdout_files([path for _, path in files], jobs, info))
+    written = []
+    for i, group in groupby(parsed, key=lambda item: item[0]):
+        segments = []
+        for _, (path, data) in group:
+            written.append(write_table(to_columns(data), os.path.join(output, names[i], os.path.basename(path)), fmt))
+            if run and not info.get(path).get("min"):
+                segments.append((path, data))
+        if segments:
+            written.append(write_table(stitch_run(segments, info), os.path.join(output, names[i], "run"), fmt))
+    if rmsd:
+        # the frames of each directory are analysed in parallel
+        from . import analysis
+        analysis.max_workers = jobs
+        for snapshot, name in zip(snapshots, names):
+            try:
+                results = compute_rmsd(snapshot, topology, mask, stride)
+            except Exception:
+                log.exception(f"Could not compute the RMSD in {snapshot.path}")
+                continue
+            if results is not None:
+                written.append(write_table(results, os.path.join(output, name, "rmsd"), fmt))
+    return written
+
+
+def summarize(path):
+    """Returns the progress of the simulations of a MD directory, as a dictionary of SUMMARY_COLUMNS"""
+    snapshot = DirectorySnapshot(path)
+    info = MdoutInfo()
+    mdout = [os.path.join(path, f) for f in snapshot.mdout]
+    md_files = [f for f in mdout if not info.get(f).get("min")]
+    lengths = [info.length(f)[1] for f in md_files]
+    mdinfo = None
+    if snapshot.stat("mdinfo") is not None:
+        is_min = bool(mdout and info.get(mdout[0]).get("min"))
+        mdinfo = MdinfoReader(os.path.join(path, "mdinfo")).read(is_min, snapshot.stat("mdinfo"))
+    row = progress_row(path, mdinfo)
+    row["simulations"] = len(md_files)
+    row["ns"] = sum(ns for ns in lengths if ns)
+    return row
+
+
+def summary(md_dirs, jobs=1):
+    """Returns the progress of the simulations of MD directories (read by `jobs` threads), as a dictionary of
+    SUMMARY_COLUMNS. Missing values are NaN, or empty strings for text"""
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        rows = list(ex.map(summarize, md_dirs))
+    columns = {}
+    for key, _, _ in SUMMARY_COLUMNS:
+        values = [row[key] for row in rows]
+        if key == "update_time":
+            values = [local_time(t) for t in values]
+        elif key in ("directory", "time_left"):
+            values = [v or "" for v in values]
+        else:
+            values = [np.nan if v is None else v for v in values]
+        columns[key] = values
+    return columns
+
+
+def format_summary(columns):
+    """Returns the summary as a text table"""
+    lines = [[title for _, title, _ in SUMMARY_COLUMNS]]
+    for i in range(len(columns["directory"])):
+        lines.append([
+            "" if isinstance(columns[key][i], float) and np.isnan(columns[key][i]) else fmt.format(columns[key][i])
+            for key, _, fmt in SUMMARY_COLUMNS
+        ])
+    widths = [max(len(line[j]) for line in lines) for j in range(len(SUMMARY_COLUMNS))]
+    return "\n".join(
+        "  ".join(value.ljust(width) if j == 0 else value.rjust(width) for j, (value, width) in enumerate(zip(line, widths)))
+        for line in lines
+    )
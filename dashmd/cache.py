@@ -0,0 +1,45 @@
+import os, json, hashlib, logging, threading
+import numpy as np
+
+log = logging.getLogger("dashmd")
+
+# directory where parsed data is saved between sessions
+CACHE_DIR = os.environ.get(
+    "DASHMD_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "dashmd")
+)
+
+
+def cache_file(kind, *key):
+    """Returns the path (without extension) used to cache some data identified by a key"""
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(CACHE_DIR, kind, digest)
+
+
+def save_array(name, array, meta):
+    """Save an array and its metadata in the cache"""
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    meta = dict(meta, shape=list(array.shape))
+    # write to temporary files first so that readers never see a partial file, one per thread saving it
+    tmp = f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp + ".npy", "wb") as f:
+        np.save(f, array)
+    with open(tmp + ".json", "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp + ".npy", name + ".npy")
+    os.replace(tmp + ".json", name + ".json")
+    log.debug(f"Saved {array.shape} array to {name}.npy")
+
+
+def load_array(name):
+    """Returns the metadata and the memory-mapped array saved in the cache, or (None, None)"""
+    try:
+        with open(name + ".json") as f:
+            meta = json.load(f)
+        array = np.load(name + ".npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None, None
+    # the array was replaced after the metadata was read
+    if list(array.shape) != meta.pop("shape"):
+        return None, None
+    return meta, array
@@ -1,11 +1,7 @@
-import argparse, logging, os
-from tornado.ioloop import IOLoop
-from bokeh.application.handlers import DirectoryHandler
-from bokeh.application import Application
-from bokeh.server.server import Server
-from bokeh.settings import settings
+import argparse, logging, os, sys
 from .version import __version__
 from .logger import loglevel, dashmd_loglevel_to_bokeh
+from .batch import FORMATS, RMSD_MASK
 
 def parse_args():
     current_dir = os.path.abspath(os.path.curdir)
@@ -20,23 +16,111 @@ def parse_args():
         help="Port number used by the bokeh server")
     parser.add_argument("-u", "--update", type=int, default=20, metavar="INT",
         help="Update rate to check and load new data, in seconds")
+    parser.add_argument("--watch", action="store_true",
+        help="Update as soon as the mdinfo, mdout or restart files change instead of polling "
+        "(uses watchdog if installed, else inotify)")
+    parser.add_argument("-w", "--window", type=int, default=100, metavar="INT",
+        help="Number of points used for the moving average of the plots")
+    parser.add_argument("--retention", type=int, default=10000, metavar="INT",
+        help="Number of the latest points of the live plots kept at full resolution, "
+        "the older points are downsampled. Use 0 to keep all the points")
+    parser.add_argument("--history", type=int, default=2000, metavar="INT",
+        help="Number of points kept for the data older than the retention of the live plots")
+    parser.add_argument("--fleet", type=str, default=None, metavar="STR",
+        help="Root directory or glob of the MD directories summarized in the Fleet tab")
+    parser.add_argument("--fleet-rate", type=int, default=50, metavar="INT",
+        help="Maximum number of files checked per second by the Fleet tab")
     parser.add_argument("-d", "--default-dir", type=str, default="./", metavar="STR",
         help="Default directory")
     parser.add_argument("--log", metavar="level", help="Set level of the logger",
         choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'], default='INFO')
 
+    # Headless commands, the dashboard is started when no command is given
+    subparsers = parser.add_subparsers(dest="command", metavar="command",
+        help="Process MD directories without starting the dashboard")
+    export_parser = subparsers.add_parser("export",
+        help="Export the data parsed from the mdout files (and the RMSD) of MD directories",
+        description="Export the data parsed from the mdout files (and the RMSD) of MD directories, "
+        "in one sub-directory of the output directory per MD directory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    summary_parser = subparsers.add_parser("summary",
+        help="Print the progress of the simulations of MD directories",
+        description="Print the progress of the simulations of MD directories",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    for subparser in (export_parser, summary_parser):
+        subparser.add_argument("directories", nargs="+", metavar="DIR",
+            help="MD directories or globs")
+        subparser.add_argument("-r", "--recursive", action="store_true",
+            help="Search the directories containing a mdinfo file below the given directories")
+        subparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), metavar="INT",
+            help="Number of files processed in parallel")
+        subparser.add_argument("--log", metavar="level", help="Set level of the logger",
+            choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'], default=argparse.SUPPRESS)
+    export_parser.add_argument("-o", "--output", type=str, default="dashmd_export", metavar="STR",
+        help="Output directory")
+    export_parser.add_argument("-f", "--format", choices=FORMATS, default="csv",
+        help="Format of the exported files (parquet requires pyarrow)")
+    export_parser.add_argument("--run", action="store_true",
+        help="Also export the MD simulations of each directory stitched on a continuous time axis")
+    export_parser.add_argument("--rmsd", action="store_true",
+        help="Also export the RMSD to the first frame of the trajectories of each directory")
+    export_parser.add_argument("--mask", type=str, default=RMSD_MASK, metavar="STR",
+        help="Mask of the atoms used for the RMSD")
+    export_parser.add_argument("--topology", type=str, default=None, metavar="STR",
+        help="Name of the topology file used for the RMSD, the first one of each directory if not set")
+    export_parser.add_argument("--stride", type=int, default=1, metavar="INT",
+        help="Only compute the RMSD every INT frames")
+    summary_parser.add_argument("-o", "--output", type=str, default=None, metavar="STR",
+        help="Write the summary to a .csv, .parquet or .npz file instead of printing it")
+
     # Parse arguments from command line
     args = parser.parse_args()
     return args
 
 
-def main():
-    # parse command line arguments
-    args = parse_args()
-    # set the logger
-    log = logging.getLogger("dashmd")
-    log.setLevel(loglevel.get(args.log))
-    log.debug(f"Set log level to '{args.log}'")
+def export_command(args, log):
+    """Export the data of the MD directories"""
+    from .batch import md_directories, export
+    md_dirs = md_directories(args.directories, args.recursive)
+    if not md_dirs:
+        log.error("No MD directory found")
+        sys.exit(1)
+    log.info(f"Exporting {len(md_dirs)} MD directories to {args.output}")
+    try:
+        written = export(md_dirs, args.output, fmt=args.format, jobs=args.jobs, run=args.run,
+            rmsd=args.rmsd, topology=args.topology, mask=args.mask, stride=args.stride)
+    except (RuntimeError, ValueError) as e:
+        log.error(e)
+        sys.exit(1)
+    log.info(f"Wrote {len(written)} files")
+
+
+def summary_command(args, log):
+    """Print or save the progress of the MD directories"""
+    from .batch import md_directories, summary, format_summary, write_table
+    md_dirs = md_directories(args.directories, args.recursive)
+    if not md_dirs:
+        log.error("No MD directory found")
+        sys.exit(1)
+    columns = summary(md_dirs, jobs=args.jobs)
+    if args.output is None:
+        print(format_summary(columns))
+        return
+    path, ext = os.path.splitext(args.output)
+    try:
+        write_table(columns, path, ext.lstrip("."))
+    except (RuntimeError, ValueError) as e:
+        log.error(e)
+        sys.exit(1)
+    log.info(f"Wrote the summary of {len(md_dirs)} MD directories to {args.output}")
+
+
+def serve(args, log):
+    """Start the Bokeh server and open the dashboard"""
+    from tornado.ioloop import IOLoop
+    from bokeh.application.handlers import DirectoryHandler
+    from bokeh.application import Application
+    from bokeh.server.server import Server
     os.environ['BOKEH_PY_LOG_LEVEL'] = dashmd_loglevel_to_bokeh.get(args.log)
     os.environ['BOKEH_LOG_LEVEL'] = dashmd_loglevel_to_bokeh.get(args.log)
     log.debug(f"Set Bokeh log level to '{dashmd_loglevel_to_bokeh.get(args.log)}'")
@@ -49,7 +133,7 @@ def main():
         os.environ['BOKEH_RESOURCES'] = 'cdn'
         # create app
         app_dir = os.path.dirname(os.path.realpath(__file__))
-        bokeh_app = Application(DirectoryHandler(filename=app_dir, argv=[args.default_dir, args.update, args.port]))
+        bokeh_app = Application(DirectoryHandler(filename=app_dir, argv=[args.default_dir, args.update, args.port, args.window, args.watch, args.retention, args.history, args.fleet, args.fleet_rate]))
         # create server
         server = Server(
             {'/': bokeh_app}, io_loop=io_loop,
@@ -64,3 +148,18 @@ def main():
     log.info(f"Opening DashMD on http://localhost:{args.port}")
     server.io_loop.add_callback(server.show, "/")
     server.io_loop.start()
+
+
+def main():
+    # parse command line arguments
+    args = parse_args()
+    # set the logger
+    log = logging.getLogger("dashmd")
+    log.setLevel(loglevel.get(args.log))
+    log.debug(f"Set log level to '{args.log}'")
+    if args.command == "export":
+        export_command(args, log)
+    elif args.command == "summary":
+        summary_command(args, log)
+    else:
+        serve(args, log)
@@ -1,32 +1,42 @@
-import re, os, sys, time, copy, glob, sys, logging
+import os, sys, time, copy, glob, sys, logging
 #from io import StringIO
-from tempfile import NamedTemporaryFile
 from math import pi
 from collections import OrderedDict
 from functools import partial
-from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import subprocess
 import numpy as np
 import pandas as pd
 import pytraj as pt
 #import parmed as pmd
 from bokeh.models import (
-    ColumnDataSource, CustomJS, CustomJSTransform,
-    Legend, PrintfTickFormatter, Range1d, Div,
+    ColumnDataSource, CustomJS,
+    Legend, PrintfTickFormatter, Range1d, DataRange1d, Div, GlyphRenderer,
 )
 from bokeh.models.widgets import (
     TextInput, Button, Div, Toggle, Select, Slider, MultiSelect, CheckboxButtonGroup
 )
 from bokeh.layouts import column
-from bokeh.transform import transform, cumsum
+from bokeh.transform import cumsum
 from bokeh.plotting import figure
 from utils import *
+from .mdout import MDOUT_KEYS, MdoutRun
+from .decimation import LevelOfDetail, RollingHistory
+from .monitor import get_monitor, executor
+from .analysis import TrajectoryAnalysis, ANALYSES
+from .topology import load_topology
+from .structure import read_structure, select_atoms, selection_key, subset_pdb, FrameReader
 
 log = logging.getLogger("dashmd")
 
+# frames per second when playing a trajectory in the View tab
+FRAME_RATE = 15
+
 
 class Dashboard:
-    def __init__(self, default_dir, port):
+    def __init__(self, doc, default_dir, port, avg_window=100, retention=10000, history=2000):
+        # bokeh document of the session
+        self.doc = doc
         # path to source directory
         self.src_dir = os.path.dirname(os.path.abspath(__file__))
         # MD directory and files selection
@@ -42,8 +52,16 @@ class Dashboard:
         )
         # button to load content
         self.mdout_button = Button(width=80, height=50, label="Plot", button_type="primary")
+        # plot the selected MD simulations (all of them if none is selected) one after the other
+        self.run_toggle = Toggle(label="Whole run", width=100, height=50, active=False)
+        self.run_sel = MultiSelect(title="Segments of the whole run (all if none is selected)", width=300, height=100,
+            value=[], options=[])
         self.mdout_files = [None]
-        self.md_mdout_files = []
+        # reader following the mdout file currently plotted, number of its records displayed,
+        # and number of times the file was rewritten when it was last displayed
+        self.mdout_reader = None
+        self.mdout_shown = 0
+        self.mdout_generation = 0
         # mdinfo figures
         progressbar_tooltip = """
         <span style="color:#428df5">@completed{0,0}</span> out of <span style="color:#428df5">@total{0,0}</span> steps (<span style="color:#428df5">@remaining{0,0}</span> remaining)
@@ -126,12 +144,22 @@ class Dashboard:
         self.bar.hover[0].mode = "hline"
 
         ## Mdout figures
-        self.mdinfo_CDS = ColumnDataSource(copy.deepcopy(empty_mddata_dic))
-        self.moving_avg_trans = CustomJSTransform(v_func=moving_avg_func)
+        self.mdinfo_CDS = ColumnDataSource(copy.deepcopy(empty_mdplot_dic))
+        # last record of the mdinfo file streamed to the plots
+        self.mdinfo_record = None
+        # moving averages of the plotted data
+        self.avg_window = avg_window
+        self.moving_avgs = {key: MovingAverage(avg_window) for key in moving_avg_keys}
+        # number of points sent to the browser for long simulations
+        self.lod = LevelOfDetail(n_points=4000)
+        # points kept when following the mdinfo file, so that long sessions use a bounded memory
+        self.retention = RollingHistory(recent=retention, history=history)
+        # the mdout figures share the same x axis, so that zooming on one updates the others
+        self.mdout_x_range = DataRange1d()
         ticker = PrintfTickFormatter(format="%4.0e")
         # Temperature
         self.temperature_fig = figure(plot_height=size[1], plot_width=size[0],
-            active_scroll="wheel_zoom",
+            active_scroll="wheel_zoom", x_range=self.mdout_x_range,
         )
         self.temperature_fig.toolbar.autohide = True
         self.temperature_fig.xaxis.axis_label = "Number of steps"
@@ -139,26 +167,26 @@ class Dashboard:
         self.temperature_fig.xaxis.formatter = ticker
         r = self.temperature_fig.line(
             "Nsteps","Temperature", color=palette[0], source=self.mdinfo_CDS, _width=1, alpha=0.15)
-        self.temperature_fig.line(transform("Nsteps", self.moving_avg_trans), transform("Temperature", self.moving_avg_trans),
+        self.temperature_fig.line("Nsteps", "Temperature_avg",
                  color=colorscale(palette[0],0.85), source=self.mdinfo_CDS, line_width=3)
         self.temperature_fig.add_tools(make_hover([r]))
 
         # Pressure
         self.pressure_fig = figure(plot_height=size[1], plot_width=size[0],
-            active_scroll="wheel_zoom",
+            active_scroll="wheel_zoom", x_range=self.mdout_x_range,
         )
         self.pressure_fig.toolbar.autohide = True
         self.pressure_fig.xaxis.axis_label = "Number of steps"
         self.pressure_fig.yaxis.axis_label = "Pressure"
         self.pressure_fig.xaxis.formatter = ticker
         r = self.pressure_fig.line("Nsteps","Pressure", color=palette[1], source=self.mdinfo_CDS, line_width=1, alpha=0.15)
-        self.pressure_fig.line(transform("Nsteps", self.moving_avg_trans), transform("Pressure", self.moving_avg_trans),
+        self.pressure_fig.line("Nsteps", "Pressure_avg",
                  color=colorscale(palette[1],0.85), source=self.mdinfo_CDS, line_width=3)
         self.pressure_fig.add_tools(make_hover([r]))
 
         # Energy
         self.energy_fig = figure(plot_height=size[1], plot_width=size[0],
-            active_scroll="wheel_zoom",
+            active_scroll="wheel_zoom", x_range=self.mdout_x_range,
         )
         etot  = self.energy_fig.line("Nsteps","Etot",  color=palette[2], source=self.mdinfo_CDS, line_width=1)
         ektot = self.energy_fig.line("Nsteps","EKtot", color=palette[3], source=self.mdinfo_CDS, line_width=1)
@@ -179,31 +207,35 @@ class Dashboard:
 
         # Volume
         self.vol_fig = figure(plot_height=size[1], plot_width=size[0],
-            active_scroll="wheel_zoom",
+            active_scroll="wheel_zoom", x_range=self.mdout_x_range,
         )
         self.vol_fig.toolbar.autohide = True
         self.vol_fig.xaxis.axis_label = "Number of steps"
         self.vol_fig.yaxis.axis_label = "Volume"
         self.vol_fig.xaxis.formatter = ticker
         r = self.vol_fig.line("Nsteps","Volume", color=palette[6], source=self.mdinfo_CDS, line_width=1, alpha=0.15)
-        self.vol_fig.line(transform("Nsteps", self.moving_avg_trans), transform("Volume", self.moving_avg_trans),
+        self.vol_fig.line("Nsteps", "Volume_avg",
                  color=colorscale(palette[6],0.85), source=self.mdinfo_CDS, line_width=3)
         self.vol_fig.add_tools(make_hover([r]))
 
         # Density
         self.density_fig = figure(plot_height=size[1], plot_width=size[0],
-            active_scroll="wheel_zoom",
+            active_scroll="wheel_zoom", x_range=self.mdout_x_range,
         )
         self.density_fig.toolbar.autohide = True
         self.density_fig.xaxis.axis_label = "Number of steps"
         self.density_fig.yaxis.axis_label = "Density"
         self.density_fig.xaxis.formatter = ticker
         r = self.density_fig.line("Nsteps","Density", color=palette[7], source=self.mdinfo_CDS, line_width=1, alpha=0.15)
-        self.density_fig.line(transform("Nsteps", self.moving_avg_trans), transform("Density", self.moving_avg_trans),
+        self.density_fig.line("Nsteps", "Density_avg",
                  color=colorscale(palette[7],0.85), source=self.mdinfo_CDS, line_width=3)
         self.density_fig.add_tools(make_hover([r]))
+        # x column of the mdout figures: steps, or time when plotting several simulations
+        self.mdout_figs = [self.temperature_fig, self.pressure_fig, self.energy_fig, self.vol_fig, self.density_fig]
+        self.mdout_x = "Nsteps"
 
-        ## RMSD figure
+        ## trajectory analyses figures
+        # RMSD
         self.empty_rmsd_dic = {k:[] for k in ["Time","RMSD"]}
         self.rmsd_CDS = ColumnDataSource(self.empty_rmsd_dic)
         self.rmsd_fig = figure(plot_height=size[1], plot_width=size[0],
@@ -219,7 +251,65 @@ class Dashboard:
             ("Time (ps)", "@Time{0,0}"),
             ("RMSD (Å)", "@RMSD")
         ]))
-        self.rmsd_button = Button(width=100, label="Calculate RMSD", button_type="primary")
+        # RMSF
+        self.empty_rmsf_dic = {k:[] for k in ["Residue","Name","RMSF"]}
+        self.rmsf_CDS = ColumnDataSource(self.empty_rmsf_dic)
+        self.rmsf_fig = figure(plot_height=size[1], plot_width=size[0],
+            active_scroll="wheel_zoom",
+        )
+        self.rmsf_fig.toolbar.autohide = True
+        self.rmsf_fig.xaxis.axis_label = "Residue"
+        self.rmsf_fig.yaxis.axis_label = "RMSF (Å)"
+        r = self.rmsf_fig.vbar(
+            x="Residue", top="RMSF", width=0.8, color=palette[4], source=self.rmsf_CDS)
+        self.rmsf_fig.add_tools(make_hover([r], tooltips=[
+            ("Residue", "@Name @Residue"),
+            ("RMSF (Å)", "@RMSF")
+        ]))
+        # radius of gyration
+        self.empty_rg_dic = {k:[] for k in ["Time","Rg"]}
+        self.rg_CDS = ColumnDataSource(self.empty_rg_dic)
+        self.rg_fig = figure(plot_height=size[1], plot_width=size[0],
+            active_scroll="wheel_zoom",
+        )
+        self.rg_fig.toolbar.autohide = True
+        self.rg_fig.xaxis.axis_label = "Time (ps)"
+        self.rg_fig.yaxis.axis_label = "Radius of gyration (Å)"
+        self.rg_fig.xaxis.formatter = ticker
+        r = self.rg_fig.line(
+            "Time","Rg", color=palette[6], source=self.rg_CDS, line_width=2)
+        self.rg_fig.add_tools(make_hover([r], tooltips=[
+            ("Time (ps)", "@Time{0,0}"),
+            ("Rg (Å)", "@Rg")
+        ]))
+        # distances, one line per pair of masks is added when computing them
+        self.distances_CDS = ColumnDataSource({"Time": []})
+        self.distances_fig = figure(plot_height=size[1], plot_width=size[0],
+            active_scroll="wheel_zoom",
+        )
+        self.distances_fig.toolbar.autohide = True
+        self.distances_fig.xaxis.axis_label = "Time (ps)"
+        self.distances_fig.yaxis.axis_label = "Distance (Å)"
+        self.distances_fig.xaxis.formatter = ticker
+        # data source of each analysis
+        self.analysis_CDS = {
+            "RMSD": self.rmsd_CDS,
+            "RMSF": self.rmsf_CDS,
+            "Radius of gyration": self.rg_CDS,
+            "Distances": self.distances_CDS,
+        }
+        self.analysis_sel = CheckboxButtonGroup(
+            labels=[name for name in ANALYSES if name in self.analysis_CDS],
+            active=[0],
+        )
+        self.distances = TextInput(
+            title="Distances (pairs of masks separated by ;)", value="", width=300,
+            placeholder=":10@CA :50@CA; :LIG protein",
+        )
+        self.analysis_button = Button(width=100, label="Calculate", button_type="primary")
+        self.analysis_error = Div(width=300, text="", style={"color": "red"})
+        # last calculation, extended when new frames are written
+        self.analysis_calc = None
         self.trajectory = MultiSelect(
             title="Trajectory file(s)", width=400,
             value=None, options=[],
@@ -237,15 +327,38 @@ class Dashboard:
         self.last_rst_update = 0
         self.view_button = Button(width=80, label="Visualize", button_type="primary")
         self.view_canvas = Div(width=size[0], height=size[1]+60, css_classes=["ngldiv"], text="")
+        # topology (PDB data sent once per topology) and coordinates displayed by NGL
+        self.ngl_topology_CDS = ColumnDataSource({"key": [], "pdb": []})
+        self.ngl_coords_CDS = ColumnDataSource({"xyz": np.zeros(0, dtype=np.float32)}, tags=[0])
         self.ngl_help_div = Div(width=0, height=0, text="")
         self.ngl_help_button = Toggle(width=80, label="Help", active=False)
         self.ngl_lig = TextInput(title="Ligand name", value="LIG", width=80)
+        self.ngl_shell = TextInput(title="Water shell (Å)", value="", width=100)
+        # frames of the trajectories selected in the View tab, the frame being read, the frames being read
+        # in advance, and the playback
+        self.frames_button = Button(width=80, label="Frames", button_type="primary")
+        self.frame_slider = Slider(title="Frame", start=0, end=1, value=0, step=1, width=400, disabled=True)
+        self.play_button = Toggle(width=80, label="Play", active=False)
+        self.frame_reader = None
+        self.frame_loading = False
+        self.frame_prefetch = None
+        self.play_callback = None
+        # atoms sent to NGL (None for all), and the topology and settings used to select them
+        self.ngl_atoms = None
+        self.ngl_selection = None
         self.ngl_representations = CheckboxButtonGroup(
             labels=["Protein","Ligand","Water","Lipids","Ions"],
             active=[0,1,2,3,4],
         )
-        # info about simulation files (min, dt, rst and mdcrd files)
-        self.mdout_info = {}
+        # monitor of the MD directory shared with the other sessions, its update rate while the
+        # dashboard is following it (None when stopped), and if file changes trigger the updates
+        self.monitor = get_monitor(default_dir)
+        # files of the MD directory displayed in the widgets
+        self.snapshot = None
+        self.update_rate = None
+        self.watch = False
+        # duration of each step of the last update
+        self.timings = OrderedDict()
         # add callbacks
         self.add_callbacks()
         self.md_dir.value = default_dir
@@ -289,314 +402,592 @@ class Dashboard:
 
     def traj_top_callback(self, attr, old, new):
         log.debug(f"Updating list of trajectory and topology files")
+        # the monitor of the new directory is subscribed after this callback
+        self.snapshot = None
         try:
-            # search netcdf files
-            traj = [
-                f for f in os.listdir(self.md_dir.value)
-                    if re.search(r'.+\.n(et)?c(df)?$', f)
-            ]
-            traj.sort(key=lambda f: os.path.getmtime(os.path.join(self.md_dir.value, f)), reverse=True)
-            self.trajectory.options = traj
-            # search restart files
-            restart = [
-                f for f in os.listdir(self.md_dir.value)
-                    if re.search(r'.+\.rst7?$', f)
-            ]
-            restart.sort(key=lambda f: os.path.getmtime(os.path.join(self.md_dir.value, f)), reverse=True)
-            self.rst_traj.options = restart
-            if self.rst_traj.options:
-                self.rst_traj.value = self.rst_traj.options[0]
-            # search for .top, .prmtop, .parm7 or .prm
-            top = [
-                f for f in os.listdir(self.md_dir.value)
-                    if re.search(r'.+\.(prm)?top$', f) or re.search(r'.+\.pa?rm7?$', f)
-            ]
-            self.topology.options = top
-            if self.topology.options:
-                self.topology.value = self.topology.options[0]
-
+            self.show_files(get_monitor(new).snapshot())
         except FileNotFoundError:
             pass
 
 
-    def compute_rmsd(self):
-        """Compute RMSD during a trajectory"""
-        self.rmsd_button.button_type = "default"
-        mask = self.mask.value.replace("protein", ":ALA,ARG,ASH,ASN,ASP,CYM,CYS,CYX,GLH,GLN,GLU,GLY,HID,HIE,HIP,HYP,HIS,ILE,LEU,LYN,LYS,MET,PHE,PRO,SER,THR,TRP,TYR,VAL")
+    def show_files(self, snapshot):
+        """Update the lists of trajectory, restart and topology files that changed since the previous snapshot"""
+        if os.path.realpath(snapshot.path) != os.path.realpath(self.md_dir.value):
+            # update of the previous directory (the monitor is shared by all the spellings of its path)
+            return
+        changes = snapshot.changes(self.snapshot)
+        previous, self.snapshot = self.snapshot, snapshot
+        if "trajectory" in changes:
+            self.trajectory.options = snapshot.trajectories
+        if "restart" in changes:
+            # keep following the latest restart file
+            follow = (previous is None) or (not self.rst_traj.options) or (self.rst_traj.value == self.rst_traj.options[0])
+            self.rst_traj.options = snapshot.restarts
+            if self.rst_traj.options and (follow or (self.rst_traj.value not in self.rst_traj.options)):
+                self.rst_traj.value = self.rst_traj.options[0]
+        if "topology" in changes:
+            self.topology.options = snapshot.topologies
+            if self.topology.options and ((previous is None) or (self.topology.value not in self.topology.options)):
+                self.topology.value = self.topology.options[0]
+
+
+    def compute_analyses(self):
+        """Compute the selected analyses during a trajectory, the plots are updated while the frames are being read"""
+        if self.analysis_button.button_type == "default":
+            log.debug("The analyses are already being computed")
+            return
+        if not (self.topology.value and self.trajectory.value):
+            self.show_analysis_error("Select a topology and trajectory file(s) to compute the analyses")
+            return
+        names = [self.analysis_sel.labels[i] for i in sorted(self.analysis_sel.active)]
+        try:
+            analyses = [
+                ANALYSES[name](self.distances.value if name == "Distances" else self.mask.value)
+                for name in names
+            ]
+        except ValueError as e:
+            self.show_analysis_error(f"Invalid analysis: {e}")
+            return
+        if not analyses:
+            return
+        self.analysis_error.text = ""
+        self.analysis_button.button_type = "default"
         topology = os.path.join(self.md_dir.value, self.topology.value)
         trajectories = [os.path.join(self.md_dir.value, f) for f in self.trajectory.value]
         trajectories.sort(key=lambda f: os.path.getmtime(f), reverse=False)
-        traj = pt.iterload(trajectories, topology)
-        stepsize=get_stepsize(traj)
-        frames = list(traj.iterframe(step=stepsize, autoimage=True, rmsfit=False,
-            mask=mask))
-        log.debug(f"Computing RMSD for top {topology} and traj {trajectories} with a step of {stepsize}, using mask {mask}")
-        ref = frames[0]
-        results = {"Time": [], "RMSD": []}
-        with ProcessPoolExecutor(max_workers=max_workers) as ex:
-            for rmsd, frame in zip(ex.map(partial(compute_rmsd, ref=ref), frames), frames):
-                results["Time"].append(frame.time)
-                results["RMSD"].append(rmsd)
-        del traj
-        self.rmsd_CDS.data = results
-        self.rmsd_button.button_type = "primary"
-
-
-    def autoview_structure(self):
-        """Load structure automatically if it has been modified recently"""
-        # check if rst7 file was rewritten recently
-        update_time = os.path.getmtime(os.path.join(self.md_dir.value, self.rst_traj.value))
-        # and viewing the latest rst7 file
-        if (update_time > self.last_rst_update) and (self.rst_traj.value == self.rst_traj.options[0]):
-            log.debug(f"Updating {self.rst_traj.value} with more recent version: {update_time}")
-            self.last_rst_update = update_time
-            self.view_structure()
-        else:
-            log.debug(f"No recent update of restart {self.rst_traj.value}")
+        calc = self.analysis_calc
+        if (calc is None) or (not calc.matches(topology, trajectories, analyses)):
+            self.rmsd_CDS.data = copy.deepcopy(self.empty_rmsd_dic)
+            self.rmsf_CDS.data = copy.deepcopy(self.empty_rmsf_dic)
+            self.rg_CDS.data = copy.deepcopy(self.empty_rg_dic)
+            for analysis in analyses:
+                if analysis.name == "Distances":
+                    self.show_distance_lines(analysis)
+        executor.submit(self.read_analyses, topology, trajectories, analyses)
+
+
+    def read_analyses(self, topology, trajectories, analyses):
+        """Compute the analyses on the new frames by chunks (in a thread), and stream each chunk to the plots"""
+        try:
+            calc = self.analysis_calc
+            if (calc is None) or (not calc.matches(topology, trajectories, analyses)):
+                try:
+                    calc = TrajectoryAnalysis(topology, trajectories, analyses)
+                except Exception as e:
+                    # the masks are checked against the topology before reading any frame
+                    self.doc.add_next_tick_callback(partial(self.show_analysis_error, f"Invalid selection: {e}"))
+                    return
+                # restore what was computed during a previous session
+                calc.load_cache()
+                self.analysis_calc = calc
+            stepsize = get_stepsize(pt.iterload(calc.trajectories, load_topology(calc.topology)))
+            log.debug(f"Computing {[a.name for a in analyses]} for top {topology} and traj {trajectories} with a step of {stepsize}")
+            for updates in calc.update(stepsize):
+                self.doc.add_next_tick_callback(partial(self.show_analyses, updates))
+        except Exception:
+            log.exception("Could not compute the analyses")
+            # don't try to extend them automatically
+            self.analysis_calc = None
+        finally:
+            self.doc.add_next_tick_callback(self.analyses_done)
+
+
+    def show_distance_lines(self, analysis):
+        """Draw one line per pair of masks on the distances figure"""
+        self.distances_fig.renderers = [
+            r for r in self.distances_fig.renderers if not isinstance(r, GlyphRenderer)]
+        if self.distances_fig.legend:
+            self.distances_fig.legend.items = []
+        self.distances_CDS.data = {"Time": [], **{column: [] for column in analysis.columns}}
+        for i, (column, pair) in enumerate(zip(analysis.columns, analysis.pairs)):
+            self.distances_fig.line("Time", column, source=self.distances_CDS, line_width=2,
+                color=palette[i % len(palette)], legend=f"{column}: {pair[0]} - {pair[1]}")
+
+
+    def show_analyses(self, updates):
+        """Add new values to the plots of the analyses, or replace all of them"""
+        for name, results, append in updates:
+            if append:
+                self.analysis_CDS[name].stream(results)
+            else:
+                self.analysis_CDS[name].data = results
+
+
+    def show_analysis_error(self, message):
+        """Display why the analyses could not be computed"""
+        log.error(message)
+        self.analysis_error.text = message
+
+
+    def analyses_done(self):
+        """Allow a new calculation"""
+        self.analysis_button.button_type = "primary"
+
+
+    def autoview_files(self):
+        """Returns the restart and topology files to reload when they are modified, or None"""
+        # only when viewing the latest rst7 file
+        if self.frame_reader is not None:
+            return None
+        if self.rst_traj.value and self.topology.value and (self.rst_traj.value == self.rst_traj.options[0]):
+            return self.rst_traj.value, self.topology.value
 
 
     def view_structure(self):
         """Visualize a restart file with NGL"""
+        if self.view_button.button_type == "default":
+            log.debug("The restart file is already being read")
+            return
+        if not (self.topology.value and self.rst_traj.value):
+            log.error("Select a topology and restart file to visualize the structure")
+            return
+        self.stop_frames()
         log.debug(f"Visualizing top {self.topology.value} and restart {self.rst_traj.value}")
-        # load rst7 with pytraj (NGL cannot read it directly)
-        traj = pt.load(
+        self.view_button.button_type = "default"
+        executor.submit(self.read_structure,
             os.path.join(self.md_dir.value, self.rst_traj.value),
-            os.path.join(self.md_dir.value, self.topology.value)
-        )
-        traj = pt.autoimage(traj)
-        ## pass to parmed to write the pdb data in a StringIO
-        # struct = pmd.load_file(os.path.join(self.md_dir.value, self.topology.value), xyz=traj.xyz)
-        # f = StringIO()
-        # struct.write_pdb(f)
-        # pdb_data = f.getvalue().encode("ascii")
-        # f.close()
-        # write as pdb to temporary file (much faster than parmed + StringIO)
-        with NamedTemporaryFile() as f:
-            pt.write_traj(f.name, traj, format="pdb", overwrite=True)
-            pdb_data = f.read()
-        # create javascript code
-        with open(os.path.join(self.src_dir, "static", "js", "nglviewer.js")) as f:
-            JS_TEMPLATE = f.read()
-        self.js_view_structure.code = JS_TEMPLATE % (pdb_data)
-        # trigger javascript callback by adding an invisible character to the button label
-        self.view_button.label += " "
+            os.path.join(self.md_dir.value, self.topology.value))
+
+
+    def load_frames(self):
+        """Scrub through the frames of the selected trajectories"""
+        if not (self.topology.value and self.trajectory.value):
+            log.error("Select a topology and trajectory file(s) to view their frames")
+            return
+        self.stop_frames()
+        topology = os.path.join(self.md_dir.value, self.topology.value)
+        trajectories = [os.path.join(self.md_dir.value, f) for f in self.trajectory.value]
+        trajectories.sort(key=lambda f: os.path.getmtime(f), reverse=False)
+        self.frame_loading = True
+        executor.submit(self.read_frames, topology, trajectories)
+
+
+    def read_frames(self, topology, trajectories):
+        """Open the trajectories and read their first frames (in a thread)"""
+        try:
+            reader = FrameReader(topology, trajectories)
+            if not reader.n_frames:
+                raise ValueError("No frame in the trajectories")
+            structure = reader.frame(0)
+        except Exception:
+            log.exception(f"Could not read the frames of {trajectories}")
+            reader, structure = None, None
+        self.doc.add_next_tick_callback(partial(self.show_frames, reader, structure))
+
+
+    def show_frames(self, reader, structure):
+        """Display the first frame of the trajectories and setup the slider"""
+        self.frame_loading = False
+        if reader is None:
+            return
+        log.debug(f"Viewing {reader.n_frames} frames of {reader.trajectories}")
+        self.frame_reader = reader
+        self.frame_slider.end = max(1, reader.n_frames - 1)
+        self.frame_slider.value = 0
+        self.frame_slider.disabled = reader.n_frames < 2
+        self.show_structure(structure, rebuild=True)
+
+
+    def stop_frames(self):
+        """Go back to the restart files"""
+        self.play_button.active = False
+        self.frame_reader = None
+        self.frame_slider.disabled = True
+
+
+    def change_frame(self, attr, old, new):
+        """Display the frame selected with the slider"""
+        # while a frame is being read, the slider is checked again once it is displayed
+        if (self.frame_reader is None) or self.frame_loading:
+            return
+        structure = self.frame_reader.cached(new)
+        if structure is None:
+            self.frame_loading = True
+            executor.submit(self.read_frame, self.frame_reader, new)
+            return
+        self.show_structure(structure)
+        # read the next frames before they are needed
+        reader = self.frame_reader
+        if (self.frame_prefetch is not None) and (not self.frame_prefetch.done()):
+            return
+        if min(new + reader.prefetch // 2, reader.n_frames - 1) not in reader.frames:
+            self.frame_prefetch = executor.submit(reader.read_ahead, new + 1)
+
+
+    def read_frame(self, reader, index):
+        """Read a frame that is not in memory (in a thread)"""
+        try:
+            structure = reader.frame(index)
+        except Exception:
+            log.exception(f"Could not read frame {index} of {reader.trajectories}")
+            structure = None
+        self.doc.add_next_tick_callback(partial(self.show_frame, reader, index, structure))
+
+
+    def show_frame(self, reader, index, structure):
+        """Display a frame that was just read"""
+        self.frame_loading = False
+        if (reader is not self.frame_reader) or (structure is None):
+            return
+        self.show_structure(structure)
+        # the slider may have moved while the frame was read
+        if self.frame_slider.value != index:
+            self.change_frame("value", index, self.frame_slider.value)
+
+
+    def play_frames(self, active):
+        """Start or stop the playback of the frames"""
+        if active and (self.frame_reader is not None):
+            self.play_button.label = "Pause"
+            if self.play_callback is None:
+                self.play_callback = self.doc.add_periodic_callback(self.next_frame, 1000 / FRAME_RATE)
+        else:
+            self.play_button.label = "Play"
+            if self.play_callback is not None:
+                self.doc.remove_periodic_callback(self.play_callback)
+                self.play_callback = None
+
+
+    def next_frame(self):
+        """Move to the next frame, unless the current one is still being read"""
+        if (self.frame_reader is None) or self.frame_loading:
+            return
+        self.frame_slider.value = (self.frame_slider.value + 1) % self.frame_reader.n_frames
+
+
+    def read_structure(self, rst, top):
+        """Read the restart file for NGL (in a thread)"""
+        try:
+            structure = read_structure(rst, top)
+        except Exception:
+            log.exception(f"Could not read restart {rst} with topology {top}")
+            structure = None
+        self.doc.add_next_tick_callback(partial(self.show_view, structure))
+
+
+    def show_view(self, structure):
+        """Display the restart file that was just read"""
+        self.view_button.button_type = "primary"
+        self.show_structure(structure, rebuild=True)
+
+
+    def show_structure(self, structure, rebuild=False):
+        """Send the coordinates to NGL, and the topology if it was not sent before.
+        Unless `rebuild` is True, NGL only moves the atoms of the structure already displayed"""
+        if structure is None:
+            return
+        if rebuild:
+            # the tags of the coordinates are part of the settings checked by the javascript callback
+            self.ngl_coords_CDS.tags = [self.ngl_coords_CDS.tags[0] + 1]
+        topology, coords = structure["topology"], structure["coords"]
+        # only send the atoms of the active representations, selected again when the settings change
+        selection = (topology["key"], tuple(self.ngl_representations.active), self.ngl_lig.value, self.ngl_shell.value)
+        if rebuild or (selection != self.ngl_selection):
+            self.ngl_atoms = select_atoms(topology, coords, self.ngl_representations.active,
+                ligand=self.ngl_lig.value, shell=self.water_shell())
+            self.ngl_selection = selection
+            n_atoms = len(topology["atoms"]) if self.ngl_atoms is None else len(self.ngl_atoms)
+            log.debug(f"Selected {n_atoms} atoms out of {len(topology['atoms'])} for NGL")
+        key = selection_key(topology, self.ngl_atoms)
+        if self.ngl_topology_CDS.data["key"] != [key]:
+            log.debug(f"Sending topology {key} to NGL")
+            pdb = subset_pdb(topology, self.ngl_atoms)
+            self.ngl_topology_CDS.data = {"key": [key], "pdb": [pdb.decode()]}
+        if self.ngl_atoms is not None:
+            coords = coords.reshape(-1, 3)[self.ngl_atoms].ravel()
+        # changing the data triggers the javascript callback
+        self.ngl_coords_CDS.data = {"xyz": coords}
+
+
+    def water_shell(self):
+        """Returns the radius of the water shell displayed around the solute, 0 to display all the water molecules"""
+        try:
+            return float(self.ngl_shell.value or 0)
+        except ValueError:
+            log.error(f"Invalid water shell: {self.ngl_shell.value}")
+            return 0
 
 
     def clear_canvas(self):
         """Clear the canvas"""
         log.debug("Clearing canvas")
-        self.mdinfo_CDS.data = copy.deepcopy(empty_mddata_dic)
+        self.mdinfo_CDS.data = copy.deepcopy(empty_mdplot_dic)
+        self.mdinfo_record = None
+        self.moving_avgs = {key: MovingAverage(self.avg_window) for key in moving_avg_keys}
+        self.mdout_shown = 0
+        self.lod = LevelOfDetail(n_points=self.lod.n_points)
 
 
     def read_mdout_header(self, mdout):
         """Read the header of mdout file to search for info on minimization, dt, and output files"""
-        log.debug(f"Reading header of {mdout} mdout file")
-        mdout_path = os.path.join(self.md_dir.value, mdout)
-        found_min, found_dt, found_rst, found_mdcrd = (False, False, False, False)
-        with open(mdout_path, 'r') as f:
-            for i, line in enumerate(f):
-                re1 = re.search(r"imin\s*=\s*([01])", line)
-                if re1:
-                    self.mdout_info[mdout]["min"] = bool(int(re1.group(1)))
-                    found_min = True
-                re2 = re.search(r"dt\s*=\s*([\.0-9]+)", line)
-                if re2:
-                    self.mdout_info[mdout]["dt"] = float(re2.group(1))
-                    found_dt = True
-                re3 = re.search(r"^\| RESTRT: ([^\s]+)\s*$", line)
-                if re3:
-                    self.mdout_info[mdout]["rst"] = re3.group(1)
-                    found_rst = True
-                re4 = re.search(r"^\|  MDCRD: ([^\s]+)\s*$", line)
-                if re4:
-                    self.mdout_info[mdout]["mdcrd"] = re4.group(1)
-                    found_mdcrd = True
-                if found_min and found_rst and found_mdcrd:
-                    if self.mdout_info[mdout]["min"]: # if min, there's no dt to find
-                        log.debug(f"Finished reading header of {mdout}. Closing minimization file.")
-                        break
-                    else:
-                        if found_dt:
-                            log.debug(f"Finished reading header of {mdout}. Closing MD file.")
-                            break
-                elif i > 150:
-                    log.debug(f"Could not find all the information within the first 150 lines of {mdout}. Closing file.")
-                    break
+        return self.monitor.mdout_info.header(self.mdout_path(mdout))
 
 
     def is_min(self, mdout):
         """Returns True if minimization, False if MD, None if the 'imin' keyword was not found"""
-        try:
-            t = self.mdout_info[mdout]["min"]
-        except KeyError:
-            log.debug(f"Parsing {mdout} mdout file to see if it's a minimization")
-            self.read_mdout_header(mdout)
-            t = self.mdout_info[mdout].get("min", None)
+        t = self.read_mdout_header(mdout).get("min", None)
         log.debug(f"{mdout} is a minimization: {t}")
         return t
 
 
     def stream_mdout(self):
         """Parse and stream data from mdout files (minimization or MD simulation)"""
+        if self.run_toggle.active:
+            self.stream_run()
+            return
+        self.set_mdout_x("Nsteps")
         self.mdout_button.button_type = "default"
-        self.clear_canvas()
         mdout = self.mdout_sel.value
-        mdout_path = os.path.join(self.md_dir.value, mdout)
-        mdout_data = copy.deepcopy(empty_mddata_dic)
-        # open file
-        with open(mdout_path, 'r') as f:
-            log.debug(f"Parsing data from {mdout} mdout file")
-            lines = []
-            # stop reading when reaching the following lines
-            for line in f:
-                if ("A V E R A G E S   O V E R" in line) or ("Maximum number of minimization cycles reached" in line):
-                    break
-                lines.append(line)
-        # check if min or md:
-        parse_func = parse_min_data if self.is_min(mdout) else parse_md_data
-        # parse in parallel
-        with ProcessPoolExecutor(max_workers=max_workers) as ex:
-            for res in ex.map(parse_func, lines):
-                for k,v in res.items():
-                    mdout_data[k].extend(v)
-        # convert to numpy
-        for key, lst in mdout_data.items():
-            mdout_data[key] = np.array(lst)
-        # stream to CDS
-        log.debug(f"Done. Streaming the data from {mdout}")
-        self.mdinfo_CDS.stream(mdout_data)
-        mdout_data = copy.deepcopy(empty_mddata_dic)
+        mdout_path = self.mdout_path(mdout)
+        # only parse the new records if the file is already plotted
+        if (self.mdout_reader is None) or (self.mdout_reader.path != mdout_path):
+            self.clear_canvas()
+            # check if min or md, the reader is shared with the other sessions plotting this file
+            self.mdout_reader = self.monitor.reader(mdout, is_min=bool(self.is_min(mdout)))
+            self.mdout_generation = self.mdout_reader.generation
+        log.debug(f"Parsing data from {mdout} mdout file")
+        executor.submit(self.read_mdout, self.mdout_reader)
+
+
+    def md_files(self):
+        """Returns the mdout files of the MD simulations, in chronological order"""
+        return [f for f in reversed(self.mdout_files) if (f is not None) and not self.read_mdout_header(f).get("min")]
+
+
+    def run_segments(self):
+        """Returns the mdout files of the selected MD simulations (or of all of them), in chronological order.
+        When all of them are plotted, the simulations started later are added at the end of the run"""
+        md_files = self.md_files()
+        if self.run_sel.value:
+            return [f for f in md_files if f in self.run_sel.value]
+        return md_files
+
+
+    def mdout_path(self, mdout):
+        """Returns the path of a mdout file, as used by the readers of the monitor"""
+        return os.path.join(self.monitor.md_dir, mdout)
+
+
+    def stream_run(self):
+        """Parse the selected MD simulations and stream them on a continuous time axis"""
+        segments = self.run_segments()
+        if not segments:
+            log.error("No MD simulation to plot")
+            return
+        self.mdout_button.button_type = "default"
+        self.set_mdout_x("Time")
+        paths = [self.mdout_path(f) for f in segments]
+        run = self.mdout_reader
+        if (not isinstance(run, MdoutRun)) or (run.paths != paths):
+            self.clear_canvas()
+            run = MdoutRun(
+                [self.monitor.reader(f) for f in segments],
+                [self.read_mdout_header(f).get("dt", 0.002) for f in segments])
+            self.mdout_reader = run
+            self.mdout_generation = run.generation
+        log.debug(f"Parsing data from {run.path} mdout files")
+        executor.submit(self.read_mdout, run)
+
+
+    def read_mdout(self, reader):
+        """Parse the new records of a mdout file or of the segments of a run in a thread"""
+        try:
+            reader.read()
+            reader.save_cache()
+        except Exception:
+            log.exception(f"Could not read {reader.path}")
+        self.doc.add_next_tick_callback(partial(self.show_read, reader))
+
+
+    def show_read(self, reader):
+        """Display the records of a mdout file or run that were just read"""
         self.mdout_button.button_type = "primary"
+        if reader is self.mdout_reader:
+            self.show_mdout(reader)
 
 
-    def latest_mdout_files(self):
-        """List all mdout files present in the MD directory, sorted by modification time"""
-        mdout_files = [
-            f for f in os.listdir(self.md_dir.value)
-                if re.search(r'.+\.(md)?out$', f) and ("nohup.out" not in f)
-        ]
-        mdout_files.sort(key=lambda f: os.path.getmtime(os.path.join(self.md_dir.value, f)), reverse=True)
-        return mdout_files
+    def follow_run(self):
+        """Stitch the records read by the monitor, and add the MD simulations started since the last update"""
+        run = self.mdout_reader
+        segments = self.run_segments()
+        paths = [self.mdout_path(f) for f in segments]
+        if paths[:len(run.paths)] != run.paths:
+            # the segments have changed: stitch them again
+            self.stream_run()
+            return
+        for f in segments[len(run.paths):]:
+            log.debug(f"Adding {f} to the plotted run")
+            run.add(self.monitor.reader(f), self.read_mdout_header(f).get("dt", 0.002))
+        run.stitch()
+        self.show_mdout(run)
+
+
+    def set_mdout_x(self, key):
+        """Plot the mdout data against the number of steps or the time"""
+        if self.mdout_x == key:
+            return
+        self.mdout_x = key
+        for fig in self.mdout_figs:
+            for renderer in fig.renderers:
+                renderer.glyph.x = key
+            fig.xaxis.axis_label = "Time (ps)" if key == "Time" else "Number of steps"
+
+
+    def show_mdout(self, reader):
+        """Stream the records read from the plotted mdout file that are not displayed yet"""
+        if reader.generation != self.mdout_generation:
+            log.debug(f"{reader.path} was rewritten, clearing the plots")
+            self.clear_canvas()
+            self.mdout_generation = reader.generation
+        if reader.n_records > self.mdout_shown:
+            data = self.add_moving_avgs(reader.columns(start=self.mdout_shown))
+            self.mdout_shown += len(data["Nsteps"])
+            if self.mdout_shown > self.lod.n_points:
+                self.update_lod()
+            else:
+                log.debug(f"Streaming {len(data['Nsteps'])} new records from {reader.path}")
+                self.mdinfo_CDS.stream(data)
+
+
+    def update_lod(self):
+        """Send a downsampled version of the plotted mdout data, with more details on the visible range"""
+        data = self.mdout_reader.data[:, :self.mdout_shown]
+        ys = [data[MDOUT_KEYS.index(key)] for key in MDOUT_KEYS[2:]]
+        x = data[MDOUT_KEYS.index(self.mdout_x)]
+        indices = self.lod.indices(x, ys, self.mdout_x_range.start, self.mdout_x_range.end,
+            source=(self.mdout_reader, self.mdout_reader.generation, self.mdout_x))
+        log.debug(f"Sending {len(indices)} out of {self.mdout_reader.n_records} records")
+        data = self.mdout_reader.columns(indices=indices)
+        for key, avg in self.moving_avgs.items():
+            data[f"{key}_avg"] = avg.values[indices]
+        self.mdinfo_CDS.data = data
+
+
+    def add_moving_avgs(self, data):
+        """Update the moving averages with new data, and add them to the data"""
+        for key, avg in self.moving_avgs.items():
+            data[f"{key}_avg"] = avg.update(data[key])
+        return data
+
+
+    def callback_x_range(self, attr, old, new):
+        """Load more details when zooming on the mdout figures"""
+        if (self.mdout_reader is not None) and (self.mdout_shown > self.lod.n_points):
+            self.update_lod()
+
+
+    def change_directory(self, attr, old, new):
+        """Stop following the plotted mdout file and follow the monitor of the new directory"""
+        self.mdout_reader = None
+        self.set_mdout_x("Nsteps")
+        monitor = get_monitor(new)
+        if (monitor is not self.monitor) and (self.update_rate is not None):
+            self.monitor.unsubscribe(self)
+            monitor.subscribe(self, self.update_rate, self.watch)
+        self.monitor = monitor
+
+
+    def start_monitoring(self, update, watch=False):
+        """Receive the updates of the MD directory every `update` seconds, or when its files change"""
+        self.update_rate = update
+        self.watch = watch
+        self.monitor.subscribe(self, update, watch)
 
 
-    def get_mdout_files(self):
+    def stop_monitoring(self):
+        """Stop receiving the updates of the MD directory"""
+        self.update_rate = None
+        self.monitor.unsubscribe(self)
+
+
+    def get_mdout_files(self, mdout_files=None):
         """Update the list of mdout files and automatically select the latest one"""
         log.debug("Updating the list of mdout files")
-        self.mdout_files = [None]
         # set mdout file to read
-        self.mdout_files = self.latest_mdout_files()
-        for mdout in self.mdout_files:
-            if not mdout in self.mdout_info:
-                self.mdout_info[mdout] = {}
+        self.mdout_files = self.monitor.latest_mdout_files() if mdout_files is None else mdout_files
         mdout_options = self.mdout_sel.options
-        self.mdout_sel.options = self.mdout_files
+        if self.mdout_files != mdout_options:
+            self.mdout_sel.options = self.mdout_files
+        # MD simulations that can be stitched, in chronological order
+        md_files = self.md_files()
+        if md_files != self.run_sel.options:
+            self.run_sel.options = md_files
+            if any(f not in md_files for f in self.run_sel.value):
+                self.run_sel.value = [f for f in self.run_sel.value if f in md_files]
         # if new mdout is created
         if len(self.mdout_files) > len(mdout_options):
             self.mdout_sel.value = self.mdout_files[0]
 
 
-    def parse_mdinfo(self):
-        """Parse and stream data read from the mdinfo file"""
-        log.debug("Parsing mdinfo file")
-        mdinfo_path = os.path.join(self.md_dir.value, "mdinfo")
-
-        try:
-            with open(mdinfo_path, 'r') as f:
-                lines = f.readlines()
-        except FileNotFoundError:
-            log.error("No mdinfo file in the current directory")
+    def show_mdinfo(self, mdinfo):
+        """Display the info parsed from the mdinfo file, and stream its data if needed"""
+        if mdinfo is None:
             return
-
-        mdinfo_data = copy.deepcopy(empty_mddata_dic)
-        # min or md
-        latest_mdout_file = self.latest_mdout_files()[0]
-        parse_func = parse_min_data if self.is_min(latest_mdout_file) else parse_md_data
-
-        for i,line in enumerate(lines):
-            # data
-            res = parse_func(line)
-            for k,v in res.items():
-                mdinfo_data[k].extend(v)
-            # number of steps
-            re_steps = re.search(r"Total steps :\s*(\d+) \| Completed :\s*(\d+) \| Remaining :\s*(\d+)", line)
-            if re_steps:
-                total = int(re_steps.group(1))
-                completed = int(re_steps.group(2))
-                remaining = int(re_steps.group(3))
-                steps_patch = {
-                    "total":     [(0, total)],
-                    "completed": [(0, completed)],
-                    "remaining": [(0, remaining)],
-                }
-                self.steps_CDS.patch(steps_patch)
-                progress = 100 * completed / total
-                self.progressbar.title.text = f"Progress: {progress:6.2f}%"
-                self.progressbar.x_range.set_from_json("end", total)
-
-            # calculation speed (ns/day)
-            re_speed = re.search(r'Average timings for last', line)
-            if re_speed:
-                re_speed = re.search(r'ns/day =\s*([\.0-9]+)', lines[i+2])
-                speed = float(re_speed.group(1))
-                self.calc_speed.text = f"Calculation speed:<br/>{speed} ns/day"
-
-            # time remaining
-            re_time = re.search(r'Estimated time remaining:\s*(.+).$', line)
-            if re_time:
-                time_left = re_time.group(1)
-                time_left = pretty_time(time_left)
-                self.eta.text = f"Estimated time remaining:<br/>{time_left}"
-                break
+        latest_mdout_file = mdinfo["latest_mdout_file"]
+        # number of steps
+        if "steps" in mdinfo:
+            total, completed, remaining = mdinfo["steps"]
+            steps_patch = {
+                "total":     [(0, total)],
+                "completed": [(0, completed)],
+                "remaining": [(0, remaining)],
+            }
+            self.steps_CDS.patch(steps_patch)
+            progress = 100 * completed / total
+            self.progressbar.title.text = f"Progress: {progress:6.2f}%"
+            self.progressbar.x_range.set_from_json("end", total)
+        # calculation speed (ns/day)
+        if "speed" in mdinfo:
+            self.calc_speed.text = f"Calculation speed:<br/>{mdinfo['speed']} ns/day"
+        # time remaining
+        if "time_left" in mdinfo:
+            self.eta.text = f"Estimated time remaining:<br/>{mdinfo['time_left']}"
 
         # last update
-        self.last_update.text = f"Last update:<br/>{time_passed(os.path.getmtime(mdinfo_path))}"
-        update_time = os.path.getmtime(mdinfo_path)
+        update_time = mdinfo["update_time"]
+        self.last_update.text = f"Last update:<br/>{time_passed(update_time)}"
         if time.time() - update_time > 5*60: # not updated recently
             self.last_update.style = {"font-weight": "bold", "color": "#d62727", "margin-top": "5px"}
         else:
             self.last_update.style = {"font-weight": "bold", "color": "#444444", "margin-top": "5px"}
 
-       # only update plots if monitoring the latest mdout file
-        if self.mdout_sel.value == latest_mdout_file:
+        # only update plots if monitoring the latest mdout file
+        if self.mdout_reader is not None:
+            log.debug(f"Plots are updated from {self.mdout_reader.path}")
+        elif self.mdout_sel.value == latest_mdout_file:
             log.debug(f"Currently watching the latest mdout '{self.mdout_sel.value}'")
-            # fetch previous stream data as dict
-            last_mdinfo_stream = self.mdinfo_CDS.to_df().tail(1).reset_index(drop=True).T.to_dict().get(0)
-            if last_mdinfo_stream:
-                # format the dict
-                for key, value in last_mdinfo_stream.items():
-                    last_mdinfo_stream[key] = [value]
-                # update if mdinfo is different from the previous stream
-                if mdinfo_data != last_mdinfo_stream:
-                    log.debug("Streaming new data from mdinfo")
-                    for key, value in mdinfo_data.items():
-                        mdinfo_data[key] = np.array(value)
-                    self.mdinfo_CDS.stream(mdinfo_data)
-            else:
-                log.debug(f"No previous mdinfo data could be retrieved. Streaming new data")
-                for key, value in mdinfo_data.items():
-                    mdinfo_data[key] = np.array(value)
-                self.mdinfo_CDS.stream(mdinfo_data)
+            # update if mdinfo is different from the previous stream
+            record = mdinfo["record"]
+            if (record is not None) and (record != self.mdinfo_record):
+                log.debug("Streaming new data from mdinfo")
+                self.mdinfo_record = record
+                data = {key: np.array([value]) for key, value in zip(MDOUT_KEYS, record)}
+                self.mdinfo_CDS.stream(self.add_moving_avgs(data))
+                self.compact_mdinfo()
         else:
             log.debug(f"Currently watching mdout '{self.mdout_sel.value}' != '{latest_mdout_file}'")
 
 
+    def compact_mdinfo(self):
+        """Downsample the oldest points streamed from the mdinfo file"""
+        data = self.retention.compact(self.mdinfo_CDS.data, "Nsteps", MDOUT_KEYS[2:])
+        if data is None:
+            return
+        log.debug(f"Compacting {len(self.mdinfo_CDS.data['Nsteps'])} points from mdinfo to {len(data['Nsteps'])}")
+        self.mdinfo_CDS.data = data
+        # the moving averages are only needed for the next points
+        for avg in self.moving_avgs.values():
+            avg.values = avg.values[-self.retention.recent:]
+
+
     def display_simulations_length(self):
         """Displays simulation length"""
-        log.debug("Computing total time of simulation(s) displayed")
-        current_time = OrderedDict()
-        # discard min files and limit to XX most recent MD files
-        self.md_mdout_files = [f for f in self.mdout_sel.options if not self.is_min(f)][:self.slider.value]
-        for mdout in self.md_mdout_files:
-            mdout_path = os.path.join(self.md_dir.value, mdout)
-            i = 0
-            for line in readlines_reverse(mdout_path):
-                i+=1
-                re1 = re.search(r"NSTEP =\s*(\d+)", line)
-                if re1:
-                    current_time[mdout] = int(re1.group(1)) * self.mdout_info[mdout].get("dt", 0.002) * 1e-3 # in ns
-                    break
-                if i > 150:
-                    break
+        self.show_simulations_length(
+            self.monitor.read_simulations_length(self.mdout_sel.options, self.slider.value))
+
+
+    def show_simulations_length(self, current_time):
+        """Update the pie and bar plots with the length of the simulations"""
         data = pd.DataFrame.from_dict(
             current_time, orient="index", columns=["time"]
         ).reset_index().rename(columns={"index":"mdout"})
@@ -613,13 +1004,37 @@ class Dashboard:
         self.pie.title.text = f"Simulations length: {total_time:.2f} ns"
 
 
-    def update_dashboard(self):
-        log.debug("Starting update of the dashboard")
-        self.get_mdout_files()
-        self.parse_mdinfo()
-        self.display_simulations_length()
-        self.autoview_structure()
-        log.debug("Finished updating the dashboard")
+    def apply_updates(self, updates):
+        """Update the widgets with the data read by the monitor of the MD directory"""
+        if self.update_rate is None:
+            log.debug("The dashboard was stopped, discarding the update")
+            return
+        timings = OrderedDict(updates["timings"])
+        with timer(timings, "document"):
+            self.show_files(updates["snapshot"])
+            self.get_mdout_files(updates["mdout_files"])
+            self.show_mdinfo(updates["mdinfo"])
+            # the monitor reads the length of the simulations for the session showing the most
+            self.show_simulations_length(OrderedDict(
+                islice(updates["simulations_length"].items(), self.slider.value)))
+            if isinstance(self.mdout_reader, MdoutRun):
+                self.follow_run()
+            elif self.mdout_reader is not None:
+                self.show_mdout(self.mdout_reader)
+            # extend the analyses with the new frames
+            calc = self.analysis_calc
+            if (calc is not None) and (self.analysis_button.button_type == "primary") and calc.outdated():
+                self.analysis_button.button_type = "default"
+                executor.submit(self.read_analyses, calc.topology, calc.trajectories, calc.analyses)
+            view = self.autoview_files()
+            if view in updates["structures"]:
+                update_time, structure = updates["structures"][view]
+                if update_time > self.last_rst_update:
+                    self.last_rst_update = update_time
+                    self.show_structure(structure)
+        self.timings = timings
+        log.debug("Finished updating the dashboard in " + ", ".join(
+            f"{stage}: {duration:.3f}s" for stage, duration in timings.items()))
 
 
     def callback_slider(self, attr, old, new):
@@ -632,16 +1047,24 @@ class Dashboard:
         # User input
         self.md_dir.on_change("value_input", self.autocomp_callback)
         self.md_dir.on_change("value", self.traj_top_callback)
-        # RMSD
-        self.rmsd_button.on_click(self.compute_rmsd)
+        self.md_dir.on_change("value", self.change_directory)
+        # trajectory analyses
+        self.analysis_button.on_click(self.compute_analyses)
         # NGLView
-        self.js_view_structure = CustomJS(code="",
-            args={"ligand_mask": self.ngl_lig,"repr": self.ngl_representations}
-        )
+        with open(os.path.join(self.src_dir, "static", "js", "nglviewer.js")) as f:
+            self.js_view_structure = CustomJS(code=f.read(), args={
+                "ligand_mask": self.ngl_lig, "repr": self.ngl_representations,
+                "topology": self.ngl_topology_CDS, "coords": self.ngl_coords_CDS,
+            })
         self.ngl_help_button.on_click(self.ngl_help)
-        # hack to execute both python and JS code on button click
-        self.view_button.js_on_change("label", self.js_view_structure)
+        # the structure is displayed when new coordinates are received
+        self.ngl_coords_CDS.js_on_change("data", self.js_view_structure)
         self.view_button.on_click(self.view_structure)
+        self.frames_button.on_click(self.load_frames)
+        self.frame_slider.on_change("value", self.change_frame)
+        self.play_button.on_click(self.play_frames)
         # MDout parsing
         self.mdout_button.on_click(self.stream_mdout)
         self.slider.on_change("value_throttled", self.callback_slider)
+        self.mdout_x_range.on_change("start", self.callback_x_range)
+        self.mdout_x_range.on_change("end", self.callback_x_range)
@@ -0,0 +1,111 @@
+import logging
+import numpy as np
+
+log = logging.getLogger("dashmd")
+
+
+def lttb(x, y, n_out):
+    """Indices of the points kept by the Largest-Triangle-Three-Buckets downsampling algorithm.
+    To keep it vectorized, each triangle is formed with the averages of the previous and next buckets
+    instead of the point selected in the previous bucket"""
+    n = len(x)
+    if (n_out >= n) or (n_out < 3):
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if np.isnan(y).any():
+        y = np.where(np.isnan(y), np.nanmean(y), y)
+    # the first and last points are always kept, the others are split in buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    sizes = np.diff(edges)
+    offsets = edges[:-1] - 1
+    xs, ys = x[1:n-1], y[1:n-1]
+    avg_x = np.add.reduceat(xs, offsets) / sizes
+    avg_y = np.add.reduceat(ys, offsets) / sizes
+    # previous and next points of the triangles of each bucket
+    prev_x, prev_y = np.repeat(np.r_[x[0], avg_x[:-1]], sizes), np.repeat(np.r_[y[0], avg_y[:-1]], sizes)
+    next_x, next_y = np.repeat(np.r_[avg_x[1:], x[-1]], sizes), np.repeat(np.r_[avg_y[1:], y[-1]], sizes)
+    area = np.abs((prev_x - next_x) * (ys - prev_y) - (prev_x - xs) * (next_y - prev_y))
+    # keep the point with the largest area of each bucket
+    bucket = np.repeat(np.arange(len(sizes)), sizes)
+    candidates = np.flatnonzero(area == np.maximum.reduceat(area, offsets)[bucket])
+    _, first = np.unique(bucket[candidates], return_index=True)
+    return np.r_[0, candidates[first] + 1, n - 1]
+
+
+def lttb_union(x, ys, n_out):
+    """Indices of the points kept when downsampling several series sharing the same x values"""
+    ys = [y for y in ys if not np.isnan(y).all()]
+    if not ys:
+        return lttb(x, x, n_out)
+    n_per_series = max(3, n_out // len(ys))
+    return np.unique(np.concatenate([lttb(x, y, n_per_series) for y in ys]))
+
+
+class LevelOfDetail:
+    """Select about n_points of series sharing the same sorted x values: a coarse overview of the
+    whole series and the full resolution (if possible) on the visible range"""
+    def __init__(self, n_points=4000, overview=0.25):
+        self.n_points = n_points
+        # fraction of the points used for the overview
+        self.overview = overview
+        self.overview_cache = (None, None)
+
+
+    def indices(self, x, ys, start=None, end=None, source=None):
+        """Returns the indices of the points to display for the range start-end of the x axis.
+        `source` identifies the series (and its version), the overview of another source is never reused"""
+        n = len(x)
+        if n <= self.n_points:
+            return np.arange(n)
+        n_overview = int(self.n_points * self.overview)
+        # the overview only changes when new data is added
+        key, overview = self.overview_cache
+        if (key is None) or (key[2] != source) or (key[1] != x[0]) or (key[0] > n):
+            overview = None
+        elif n - key[0] <= n_overview // 10:
+            # only a few points were added at the end: keep all of them
+            overview = np.union1d(overview, np.arange(key[0] - 1, n))
+        else:
+            overview = None
+        if overview is None:
+            overview = lttb_union(x, ys, n_overview)
+            self.overview_cache = ((n, x[0], source), overview)
+        if (start is None) or (end is None):
+            return overview
+        # visible range, with one point on each side
+        first = max(0, np.searchsorted(x, start, side="left") - 1)
+        last = min(n, np.searchsorted(x, end, side="right") + 1)
+        if last - first <= self.n_points - n_overview:
+            return np.union1d(overview, np.arange(first, last))
+        detail = first + lttb_union(x[first:last], [y[first:last] for y in ys], self.n_points - n_overview)
+        log.debug(f"Displaying {last - first} points between {start} and {end} with {len(detail)} points")
+        return np.union1d(overview, detail)
+
+
+class RollingHistory:
+    """Retention policy of the points streamed to a live plot: the last `recent` points are kept at
+    full resolution, and the older points are downsampled to about `history` points"""
+    def __init__(self, recent=10000, history=2000):
+        self.recent = recent
+        self.history = history
+
+
+    @property
+    def limit(self):
+        """Number of points above which the plot is compacted"""
+        # wait for some new points so that the plot isn't compacted at every update
+        return self.recent + self.history + self.recent // 2
+
+
+    def compact(self, columns, x_key, y_keys):
+        """Returns the columns with the points older than the last `recent` ones downsampled,
+        or None if there are not enough points or if the retention is disabled"""
+        n = len(columns[x_key])
+        if (not self.recent) or (n <= self.limit):
+            return None
+        split = n - self.recent
+        x = np.asarray(columns[x_key][:split], dtype=float)
+        ys = [np.asarray(columns[key][:split], dtype=float) for key in y_keys]
+        indices = np.r_[lttb_union(x, ys, self.history), np.arange(split, n)]
+        return {key: np.asarray(values)[indices] for key, values in columns.items()}
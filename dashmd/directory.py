@@ -0,0 +1,75 @@
+import os, re, time, logging
+
+log = logging.getLogger("dashmd")
+
+# kind of the files listed in the dashboard, checked in this order
+FILE_KINDS = [
+    ("mdinfo", re.compile(r'^mdinfo$')),
+    ("mdout", re.compile(r'.+\.(md)?out$')),
+    ("trajectory", re.compile(r'.+\.n(et)?c(df)?$')),
+    ("restart", re.compile(r'.+\.rst7?$')),
+    ("topology", re.compile(r'.+\.(prm)?top$|.+\.pa?rm7?$')),
+]
+
+
+def file_kind(name):
+    """Returns the kind of a file from its name, or None if it is not used by the dashboard"""
+    if "nohup.out" in name:
+        return None
+    for kind, pattern in FILE_KINDS:
+        if pattern.search(name):
+            return kind
+    return None
+
+
+class DirectorySnapshot:
+    """Files of a MD directory used by the dashboard, listed and stat'ed in a single pass.
+    The files of each kind are sorted by modification time, latest first (except topologies)"""
+    def __init__(self, path):
+        self.path = path
+        self.time = time.time()
+        # stat result of each file, by name
+        self.stats = {}
+        files = {kind: [] for kind, _ in FILE_KINDS}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                kind = file_kind(entry.name)
+                if kind is None:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    self.stats[entry.name] = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files[kind].append(entry.name)
+        for kind in ("mdout", "trajectory", "restart"):
+            files[kind].sort(key=lambda f: self.stats[f].st_mtime, reverse=True)
+        self.mdout = files["mdout"]
+        self.trajectories = files["trajectory"]
+        self.restarts = files["restart"]
+        self.topologies = files["topology"]
+
+
+    def stat(self, name):
+        """Returns the stat result of a file, or None if it was not in the directory"""
+        return self.stats.get(name)
+
+
+    def mtime(self, name):
+        """Returns the modification time of a file, read again if it was not listed"""
+        stat = self.stats.get(name)
+        if stat is None:
+            return os.path.getmtime(os.path.join(self.path, name))
+        return stat.st_mtime
+
+
+    def changes(self, other):
+        """Returns the kinds of files whose list differs from another snapshot"""
+        if other is None:
+            return {"mdout", "trajectory", "restart", "topology"}
+        return {
+            kind for kind, attr in [
+                ("mdout", "mdout"), ("trajectory", "trajectories"), ("restart", "restarts"), ("topology", "topologies"),
+            ] if getattr(self, attr) != getattr(other, attr)
+        }
@@ -0,0 +1,196 @@
+import os, glob, time, logging, threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from weakref import WeakValueDictionary
+from .mdout import MdinfoReader, MDOUT_KEYS
+
+log = logging.getLogger("dashmd")
+
+# threads polling the fleets, and threads reading their mdinfo files
+FLEET_WORKERS = 8
+# maximum number of files checked per second, for all the directories of a fleet
+FLEET_RATE = 50
+# maximum depth of the MD directories below the root directory
+MAX_DEPTH = 4
+# delay (in seconds) between two searches of new MD directories
+RESCAN = 300
+# number of values of the sparklines
+SPARKLINE_POINTS = 50
+
+# polls of the sessions, and reads of the mdinfo files: a poll waits for its reads, which can't
+# be queued behind the polls waiting for the lock of the fleet
+executor = ThreadPoolExecutor(max_workers=FLEET_WORKERS)
+read_executor = ThreadPoolExecutor(max_workers=FLEET_WORKERS)
+
+# fleets displayed by at least one session
+fleets = WeakValueDictionary()
+
+
+def get_fleet(root, rate=FLEET_RATE):
+    """Returns the fleet shared by all the sessions displaying the same root directory or glob"""
+    fleet = fleets.get(root)
+    if fleet is None:
+        fleet = Fleet(root, rate)
+        fleets[root] = fleet
+    return fleet
+
+
+def find_md_dirs(root, max_depth=MAX_DEPTH, budget=None):
+    """Returns the directories containing a mdinfo file, below a root directory or the directories matching a glob.
+    Each directory listed is charged to the I/O budget, if one is given"""
+    roots = sorted(glob.glob(root)) if any(c in root for c in "*?[") else [root]
+    md_dirs = []
+    for top in roots:
+        search_md_dirs(top, max_depth, budget, md_dirs)
+    return md_dirs
+
+
+def search_md_dirs(path, depth, budget, md_dirs):
+    """Add the directories containing a mdinfo file to `md_dirs`, up to `depth` levels below `path`"""
+    try:
+        with os.scandir(path) as entries:
+            entries = list(entries)
+    except OSError:
+        return
+    if budget is not None:
+        budget.charge(1)
+    if any(entry.name == "mdinfo" for entry in entries):
+        md_dirs.append(path)
+    if depth <= 0:
+        return
+    for subdir in sorted(entry.path for entry in entries if entry.is_dir(follow_symlinks=False)):
+        search_md_dirs(subdir, depth - 1, budget, md_dirs)
+
+
+def local_time(timestamp):
+    """Returns a timestamp as a string in the local time zone, or an empty string"""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else ""
+
+
+def progress_row(path, info):
+    """Progress of the simulation of a directory from the info of its mdinfo file (which can be None)"""
+    info = info or {}
+    row = {
+        "directory": path, "progress": None, "speed": info.get("speed"),
+        "time_left": info.get("time_left"), "update_time": info.get("update_time"), "temperature": None,
+    }
+    if "steps" in info:
+        total, completed, _ = info["steps"]
+        row["progress"] = 100 * completed / total if total else None
+    if info.get("record") is not None:
+        row["temperature"] = info["record"][MDOUT_KEYS.index("Temperature")]
+    return row
+
+
+def sparkline(values, width=100, height=20):
+    """Returns a SVG line of the values"""
+    values = [v for v in values if v is not None]
+    if len(values) < 2:
+        return ""
+    low, high = min(values), max(values)
+    scale = (height - 2) / (high - low) if high > low else 0
+    step = width / (len(values) - 1)
+    points = " ".join(f"{i*step:.1f},{height - 1 - (v - low)*scale:.1f}" for i, v in enumerate(values))
+    return (
+        f'<svg width="{width}" height="{height}">'
+        f'<polyline points="{points}" fill="none" stroke="#1f77b4" stroke-width="1.5"/></svg>'
+    )
+
+
+class IoBudget:
+    """Token bucket limiting the number of files accessed per second"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.time = time.monotonic()
+
+
+    def refill(self):
+        now = time.monotonic()
+        # at most one second of accesses can be saved
+        self.tokens = min(self.rate, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+
+    def take(self, n):
+        """Returns how many of the `n` accesses can be done now"""
+        self.refill()
+        granted = max(0, min(n, int(self.tokens)))
+        self.tokens -= granted
+        return granted
+
+
+    def charge(self, n):
+        """Count accesses that were done without asking first"""
+        self.tokens -= n
+
+
+class Fleet:
+    """Progress of the simulations of all the MD directories found below a root directory or glob.
+    The mdinfo files are checked in turn, as many as the I/O budget allows at each poll"""
+    def __init__(self, root, rate=FLEET_RATE):
+        self.root = root
+        self.budget = IoBudget(rate)
+        # reader of the mdinfo file of each directory, and info read from it
+        self.readers = OrderedDict()
+        self.infos = {}
+        # speed (ns/day) of the last updates of each directory
+        self.history = {}
+        # position of the next directory to check, and time of the last search of directories
+        self.next = 0
+        self.scanned = None
+        # polls can be started by several sessions
+        self.lock = threading.Lock()
+
+
+    def scan(self):
+        """Search the MD directories, keeping what was read from the ones already known"""
+        md_dirs = find_md_dirs(self.root, budget=self.budget)
+        log.debug(f"Found {len(md_dirs)} MD directories in {self.root}")
+        readers = OrderedDict()
+        for path in md_dirs:
+            readers[path] = self.readers.get(path) or MdinfoReader(os.path.join(path, "mdinfo"))
+            self.history.setdefault(path, deque(maxlen=SPARKLINE_POINTS))
+        for path in set(self.readers) - set(readers):
+            self.infos.pop(path, None)
+            self.history.pop(path, None)
+        self.readers = readers
+        self.next = 0
+        self.scanned = time.time()
+
+
+    def poll(self):
+        """Check the mdinfo files of the directories allowed by the I/O budget, and returns the rows of the summary"""
+        with self.lock:
+            if (self.scanned is None) or (time.time() - self.scanned > RESCAN):
+                self.scan()
+            paths = list(self.readers)
+            n = self.budget.take(len(paths))
+            selected = [paths[(self.next + i) % len(paths)] for i in range(n)]
+            self.next = (self.next + n) % max(1, len(paths))
+            # the mdinfo files are only read if they were modified
+            previous = {path: self.infos.get(path) for path in selected}
+            for path, info in zip(selected, read_executor.map(self.read, selected)):
+                self.infos[path] = info
+                if (info is not None) and (info is not previous[path]):
+                    self.budget.charge(1)
+                    self.history[path].append(info.get("speed"))
+            log.debug(f"Checked {n} out of {len(paths)} MD directories of {self.root}")
+            return self.rows()
+
+
+    def read(self, path):
+        """Returns the info of the mdinfo file of a directory, or None"""
+        try:
+            return self.readers[path].read()
+        except Exception:
+            log.exception(f"Could not read the mdinfo file of {path}")
+            return None
+
+
+    def rows(self):
+        """Summary of each directory, as a list of dictionaries"""
+        return [
+            dict(progress_row(path, self.infos.get(path)), sparkline=sparkline(self.history[path]))
+            for path in self.readers
+        ]
@@ -5,9 +5,10 @@ from bokeh.io import curdoc
 from dashmd.application import create_app
 
 # parse remaining command line arguments
-_, default_dir, update, port = sys.argv
+_, default_dir, update, port, window, watch, retention, history, fleet, fleet_rate = sys.argv
 # open logger
 log = logging.getLogger("dashmd")
 # create bokeh application
 doc = curdoc()
-create_app(doc, default_dir=default_dir, update=update, port=int(port))
+create_app(doc, default_dir=default_dir, update=update, port=int(port), window=int(window), watch=watch,
+    retention=int(retention), history=int(history), fleet=fleet, fleet_rate=int(fleet_rate))
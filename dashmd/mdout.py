@@ -0,0 +1,577 @@
+import os, re, hashlib, logging, threading
+from multiprocessing import cpu_count, get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from .cache import cache_file, save_array, load_array
+
+log = logging.getLogger("dashmd")
+
+# columns of the parsed data
+MDOUT_KEYS = [
+    "Nsteps", "Time", "Temperature", "Pressure",
+    "Etot", "EKtot", "EPtot",
+    "Volume", "Density",
+]
+# stop reading when reaching one of these lines
+END_MARKERS = (b"A V E R A G E S   O V E R", b"Maximum number of minimization cycles reached")
+# line of dashes closing each record of a MD simulation
+RECORD_END = re.compile(rb"^ -{20,}[ \t\r]*$", re.M)
+# all the fields of a MD record, Volume and Density are missing for NVT simulations
+MD_RECORD = re.compile(
+    rb"NSTEP =\s*(\d+)\s+TIME\(PS\) =\s*(-?[\.0-9]+)\s+TEMP\(K\) =\s*(-?[\.0-9]+)\s+PRESS =\s*(-?[\.0-9]+)\s+"
+    rb"Etot\s+=\s*(-?[\.0-9]+)\s+EKtot\s+=\s*(-?[\.0-9]+)\s+EPtot\s+=\s*(-?[\.0-9]+)"
+    rb"(?:.*?VOLUME\s+=\s*(-?[\.0-9]+))?(?:.*?Density\s+=\s*(-?[\.0-9]+))?",
+    re.S)
+MD_RECORD_START = re.compile(rb"NSTEP =")
+# a line of minimization data: step, energy, rms, gmax, name and number of the atom
+MIN_RECORD = re.compile(
+    rb"^ +(\d+) +(-?[\.0-9]+E[+\-]\d+) +-?[\.0-9]+E[+\-]\d+ +-?[\.0-9]+E[+\-]\d+ +[A-Z0-9]+ +\d+[ \t\r]*$",
+    re.M)
+# step and time of a MD record
+MD_STEP = re.compile(rb"NSTEP =\s*(\d+)\s+TIME\(PS\) =\s*(-?[\.0-9]+)\s")
+# progress of the simulation in the mdinfo file
+MDINFO_STEPS = re.compile(rb"Total steps :\s*(\d+) \| Completed :\s*(\d+) \| Remaining :\s*(\d+)")
+MDINFO_SPEED = re.compile(rb"Average timings for last[^\n]*\n[^\n]*\n[^\n]*ns/day =\s*([\.0-9]+)")
+MDINFO_TIME_LEFT = re.compile(rb"Estimated time remaining:\s*(.+).$", re.M)
+# information in the header of mdout files
+HEADER_MIN = re.compile(r"imin\s*=\s*([01])")
+HEADER_DT = re.compile(r"dt\s*=\s*([\.0-9]+)")
+HEADER_RST = re.compile(r"^\| RESTRT: ([^\s]+)\s*$")
+HEADER_MDCRD = re.compile(r"^\|  MDCRD: ([^\s]+)\s*$")
+# number of bytes at the start of a mdout file and before the position of the reader that identify
+# the content already parsed
+SIGNATURE_SIZE = 4096
+# files are split in chunks of this size (in bytes) to be parsed in parallel
+CHUNK_SIZE = 32 * 1024**2
+max_workers = cpu_count()
+
+
+def read_header(path):
+    """Read the header of mdout file to search for info on minimization, dt, and output files"""
+    log.debug(f"Reading header of {path} mdout file")
+    info = {}
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            re1 = HEADER_MIN.search(line)
+            if re1:
+                info["min"] = bool(int(re1.group(1)))
+            re2 = HEADER_DT.search(line)
+            if re2:
+                info["dt"] = float(re2.group(1))
+            re3 = HEADER_RST.search(line)
+            if re3:
+                info["rst"] = re3.group(1)
+            re4 = HEADER_MDCRD.search(line)
+            if re4:
+                info["mdcrd"] = re4.group(1)
+            if ("min" in info) and ("rst" in info) and ("mdcrd" in info):
+                if info["min"]: # if min, there's no dt to find
+                    log.debug(f"Finished reading header of {path}. Closing minimization file.")
+                    break
+                elif "dt" in info:
+                    log.debug(f"Finished reading header of {path}. Closing MD file.")
+                    break
+            elif i > 150:
+                log.debug(f"Could not find all the information within the first 150 lines of {path}. Closing file.")
+                break
+    return info
+
+
+def file_signature(path, offset, size=SIGNATURE_SIZE):
+    """Returns a hash of the beginning of a file and of the bytes just before `offset`"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        digest.update(f.read(min(size, offset)))
+        f.seek(max(0, offset - size))
+        digest.update(f.read(offset - max(0, offset - size)))
+    return digest.hexdigest()
+
+
+def last_record(filename, blocksize=64*1024):
+    """Returns the step and time (in ps) of the last record of a MD mdout file, or None if there's none"""
+    with open(filename, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(0, end - blocksize)
+            f.seek(start)
+            # read a bit more than the block in case the record is split between 2 blocks
+            block = f.read(end - start + 128)
+            position = block.rfind(b"NSTEP =", 0, end - start)
+            while position >= 0:
+                match = MD_STEP.match(block, position)
+                if match:
+                    return int(match.group(1)), float(match.group(2))
+                # the record is still being written
+                position = block.rfind(b"NSTEP =", 0, position)
+            end = start
+    return None
+
+
+def parse_records(text, is_min=False):
+    """Parse all the records of a chunk of mdout file, returns a 2D array with one column per MDOUT_KEYS"""
+    if is_min:
+        rows = MIN_RECORD.findall(text)
+        data = np.full((len(rows), len(MDOUT_KEYS)), np.nan)
+        if rows:
+            # only the step and energy are available
+            data[:, [0, 4]] = np.array(rows, dtype=float)
+        return data
+    starts = [match.start() for match in MD_RECORD_START.finditer(text)]
+    ends = starts[1:] + [len(text)]
+    data = np.full((len(starts), len(MDOUT_KEYS)), np.nan)
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        match = MD_RECORD.match(text, start, end)
+        if match:
+            data[i] = match.groups()
+    # discard records that could not be parsed
+    return data[~np.isnan(data[:, 0])]
+
+
+def to_columns(data):
+    """Convert an array with one row per MDOUT_KEYS to a dictionary of columns"""
+    columns = {key: data[i] for i, key in enumerate(MDOUT_KEYS)}
+    columns["Nsteps"] = columns["Nsteps"].astype(np.int64)
+    return columns
+
+
+def complete_end(text, is_min=False):
+    """Returns the position after the last complete record of a chunk of mdout file"""
+    if is_min:
+        # minimization data is written one line at a time
+        return text.rfind(b"\n") + 1
+    start = text.rfind(b"NSTEP =")
+    if start < 0:
+        return 0
+    end = RECORD_END.search(text, start)
+    if end:
+        return end.end()
+    # the last record is still being written: keep it for the next read
+    return text.rfind(b"\n", 0, start) + 1
+
+
+def parse_chunk(path, start, end, is_min=False, complete=False):
+    """Parse the records between 2 byte positions of a mdout file, only the complete ones if `complete` is True.
+    Returns the data and a boolean set to True if the end of the simulation was reached"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start)
+    finished = False
+    for marker in END_MARKERS:
+        position = text.find(marker)
+        if position >= 0:
+            text = text[:position]
+            finished = True
+    if complete and not finished:
+        text = text[:complete_end(text, is_min)]
+    return parse_records(text, is_min), finished
+
+
+def record_start(f, position, is_min=False, blocksize=64*1024):
+    """Returns the position of the first record starting after a byte position, or None"""
+    pattern = b"\n" if is_min else b"NSTEP ="
+    f.seek(position)
+    block = f.read(blocksize)
+    while block:
+        found = block.find(pattern)
+        if found >= 0:
+            if is_min:
+                return position + found + 1
+            # start of the line containing the pattern
+            return position + block.rfind(b"\n", 0, found) + 1
+        # keep the end of the block in case the pattern is split between 2 blocks
+        position += len(block) - len(pattern)
+        f.seek(position)
+        block = f.read(blocksize)
+        if len(block) <= len(pattern):
+            break
+    return None
+
+
+def chunk_bounds(path, start, end, is_min=False, chunksize=CHUNK_SIZE):
+    """Split a byte range of a mdout file in chunks that start at the beginning of a record"""
+    bounds = [start]
+    with open(path, "rb") as f:
+        for position in range(start + chunksize, end, chunksize):
+            position = record_start(f, max(position, bounds[-1] + 1), is_min)
+            if (position is None) or (position >= end):
+                break
+            bounds.append(position)
+    bounds.append(end)
+    return bounds
+
+
+class MdoutRecords:
+    """Records of a simulation, stored as an array with one row per MDOUT_KEYS that grows as new records are added"""
+    @property
+    def data(self):
+        """All the records parsed, as an array with one row per MDOUT_KEYS"""
+        return self.buffer[:, :self.n_records]
+
+
+    def columns(self, start=0, indices=None):
+        """Returns the records parsed (from `start`, or only the ones at `indices`) as a dictionary of columns"""
+        if indices is not None:
+            return to_columns(self.data[:, indices])
+        return to_columns(self.data[:, start:])
+
+
+    def append(self, data):
+        """Add new records (array with one row per MDOUT_KEYS) to the data"""
+        n = data.shape[1]
+        if self.n_records + n > self.buffer.shape[1]:
+            # double the capacity to limit the number of copies
+            capacity = max(2 * self.buffer.shape[1], self.n_records + n, 1024)
+            buffer = np.empty((len(MDOUT_KEYS), capacity))
+            buffer[:, :self.n_records] = self.data
+            self.buffer = buffer
+        self.buffer[:, self.n_records:self.n_records + n] = data
+        self.n_records += n
+
+
+class MdoutReader(MdoutRecords):
+    """Follows a mdout file and only parses the records appended since the last read.
+    All the parsed data is kept and can be saved to / restored from the cache"""
+    def __init__(self, path, is_min=False):
+        self.path = path
+        self.is_min = is_min
+        self.cache_name = cache_file("mdout", os.path.realpath(path))
+        # the file can be read from the update thread and from the Plot button
+        self.lock = threading.Lock()
+        # incremented every time the file is rewritten, so that each session knows when to clear its plots
+        self.generation = 0
+        self.reset()
+
+
+    def reset(self):
+        """Forget everything that was read from the file"""
+        # position of the next byte to read, and the incomplete record read before it
+        self.offset = 0
+        self.pending = b""
+        self.inode = None
+        # size and modification time of the file at the last read
+        self.stat = None
+        # the averages or the end of the minimization were reached
+        self.finished = False
+        # parsed data, one row per MDOUT_KEYS, with some free space at the end
+        self.buffer = np.empty((len(MDOUT_KEYS), 0))
+        self.n_records = 0
+        # position of the reader when the cache was saved
+        self.cached_offset = None
+
+
+    def load_cache(self):
+        """Restore the data parsed in a previous session, if the file was not rewritten since.
+        Returns True if the cache could be used"""
+        meta, data = load_array(self.cache_name)
+        if meta is None:
+            return False
+        stat = os.stat(self.path)
+        if (
+            (meta["inode"] != stat.st_ino) or (meta["is_min"] != self.is_min)
+            or (stat.st_size < meta["size"])
+            or ((stat.st_size == meta["size"]) and (stat.st_mtime_ns != meta["mtime"]))
+            # the file was rewritten in place (e.g. pmemd -O) with more data than before
+            or (meta.get("signature") != file_signature(self.path, meta["offset"]))
+        ):
+            log.debug(f"Discarding outdated cache of {self.path}")
+            return False
+        log.debug(f"Restoring {data.shape[1]} records of {self.path} from the cache")
+        self.reset()
+        self.inode = meta["inode"]
+        self.offset = self.cached_offset = meta["offset"]
+        self.finished = meta["finished"]
+        # memory-mapped until new records are appended
+        self.buffer = data
+        self.n_records = data.shape[1]
+        return True
+
+
+    def save_cache(self):
+        """Save the data parsed so far"""
+        # the incomplete record will be read again
+        offset = self.offset - len(self.pending)
+        if (not self.n_records) or (offset == self.cached_offset):
+            return
+        inode, size, mtime = self.stat
+        try:
+            save_array(self.cache_name, self.data, {
+                "path": os.path.realpath(self.path), "inode": inode, "size": size, "mtime": mtime,
+                "offset": offset, "finished": self.finished, "is_min": self.is_min,
+                "signature": file_signature(self.path, offset),
+            })
+        except OSError as e:
+            log.warning(f"Could not save the data of {self.path} to the cache: {e}")
+            return
+        self.cached_offset = offset
+
+
+    def complete_end(self, text):
+        """Returns the position after the last complete record of the text"""
+        return complete_end(text, self.is_min)
+
+
+    def read_chunks(self, end):
+        """Parse a large amount of new data in parallel, by chunks of CHUNK_SIZE bytes.
+        Only complete chunks are parsed, the rest is left for the serial reader"""
+        bounds = chunk_bounds(self.path, self.offset, end, self.is_min)[:-1]
+        if len(bounds) < 2:
+            return []
+        log.debug(f"Parsing {self.path} in {len(bounds)-1} chunks")
+        results = []
+        # workers are spawned since the server runs several threads
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(bounds)-1), mp_context=get_context("spawn")) as ex:
+            jobs = [
+                ex.submit(parse_chunk, self.path, start, stop, self.is_min)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            for job in jobs:
+                data, finished = job.result()
+                results.append(data)
+                if finished:
+                    self.finished = True
+                    break
+        self.offset = bounds[-1]
+        return results
+
+
+    def read(self):
+        """Parse the records appended since the last read.
+        Returns the data as a dictionary of arrays (or None if there's nothing new),
+        and a boolean set to True if the file was rewritten since the last read"""
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                log.debug(f"{self.path} does not exist anymore")
+                return None, False
+            rewritten = False
+            if (self.inode is not None) and ((stat.st_ino != self.inode) or (stat.st_size < self.offset)):
+                log.debug(f"{self.path} was rewritten, reading it from the start")
+                self.reset()
+                self.generation += 1
+                rewritten = True
+            self.inode = stat.st_ino
+            self.stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if self.finished or (stat.st_size == self.offset):
+                return None, rewritten
+            results = []
+            if (not self.pending) and (stat.st_size - self.offset > 2 * CHUNK_SIZE):
+                results = self.read_chunks(stat.st_size)
+            if not self.finished:
+                with open(self.path, "rb") as f:
+                    f.seek(self.offset)
+                    chunk = f.read(stat.st_size - self.offset)
+                log.debug(f"Read {len(chunk)} new bytes from {self.path}")
+                self.offset += len(chunk)
+                text = self.pending + chunk
+                for marker in END_MARKERS:
+                    position = text.find(marker)
+                    if position >= 0:
+                        text = text[:position]
+                        self.finished = True
+                end = len(text) if self.finished else self.complete_end(text)
+                self.pending = text[end:]
+                results.append(parse_records(text[:end], self.is_min))
+            if self.finished:
+                self.pending = b""
+            data = np.concatenate(results) if results else np.empty((0, len(MDOUT_KEYS)))
+            if not len(data):
+                return None, rewritten
+            data = data.T
+            self.append(data)
+            return to_columns(data), rewritten
+
+
+class MdoutRun(MdoutRecords):
+    """Consecutive mdout files of a simulation (one per restart) stitched on a continuous time axis.
+    Each segment is parsed by its own reader, and its steps and times are shifted by the length of
+    the previous segments"""
+    def __init__(self, readers, dts):
+        self.readers = []
+        # time step (in ps) of each segment
+        self.dts = []
+        self.is_min = False
+        # incremented every time the records are stitched again from the start
+        self.generation = 0
+        # records are stitched from the update thread and from the Plot button
+        self.lock = threading.Lock()
+        self.reset()
+        for reader, dt in zip(readers, dts):
+            self.add(reader, dt)
+
+
+    @property
+    def path(self):
+        return ", ".join(os.path.basename(reader.path) for reader in self.readers)
+
+
+    @property
+    def paths(self):
+        return [reader.path for reader in self.readers]
+
+
+    @property
+    def finished(self):
+        return bool(self.readers) and self.readers[-1].finished
+
+
+    def reset(self):
+        """Forget the records stitched so far"""
+        self.buffer = np.empty((len(MDOUT_KEYS), 0))
+        self.n_records = 0
+        # number of records of each segment already stitched, and version of the segment
+        self.counts = [0] * len(self.readers)
+        self.generations = [reader.generation for reader in self.readers]
+
+
+    def add(self, reader, dt):
+        """Add a segment at the end of the run"""
+        self.readers.append(reader)
+        self.dts.append(dt)
+        self.counts.append(0)
+        self.generations.append(reader.generation)
+
+
+    def read(self):
+        """Parse the new records of all the segments in parallel, and stitch them"""
+        pending = [reader for reader in self.readers if not reader.finished]
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as ex:
+                list(ex.map(lambda reader: reader.read(), pending))
+        self.stitch()
+
+
+    def stitch(self):
+        """Add the records parsed by the readers since the last call"""
+        with self.lock:
+            new = [reader.n_records > count for reader, count in zip(self.readers, self.counts)]
+            # a segment was rewritten, or records were added to a segment followed by stitched ones
+            rewritten = [reader.generation for reader in self.readers] != self.generations
+            if rewritten or any(new[i] and any(self.counts[i+1:]) for i in range(len(new))):
+                log.debug(f"Stitching {self.path} again from the start")
+                self.generation += 1
+                self.reset()
+            offset_steps, offset_time = 0, 0.0
+            for i, (reader, dt) in enumerate(zip(self.readers, self.dts)):
+                start, n = self.counts[i], reader.n_records
+                if n > start:
+                    data = np.array(reader.data[:, start:n])
+                    data[1] = offset_time + data[0] * dt
+                    data[0] += offset_steps
+                    self.append(data)
+                    self.counts[i] = n
+                # length of the segment
+                if n:
+                    last_step = reader.data[0, n - 1]
+                    offset_steps += last_step
+                    offset_time += last_step * dt
+
+
+    def save_cache(self):
+        """Save the data parsed from each segment"""
+        for reader in self.readers:
+            reader.save_cache()
+
+
+class MdoutInfo:
+    """Cache of the header info (min, dt, rst, mdcrd) and length of mdout files.
+    An entry is only read again when the size or modification time of the file changes.
+    Entries are never modified: they are replaced, so that the threads reading them never see a partial one"""
+    def __init__(self):
+        self.entries = {}
+        # the entries are updated from the monitor thread and from the IOLoop
+        self.lock = threading.Lock()
+
+
+    def __getitem__(self, path):
+        return self.get(path)
+
+
+    def get(self, path):
+        """Returns the info on a mdout file"""
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        info = self.entries.get(path)
+        if (info is None) or (info["stat"] != key):
+            if (info is None) or (stat.st_size < info["stat"][0]) or ("min" not in info):
+                # new, rewritten, or incomplete header
+                info = dict(read_header(path), stat=key)
+            else:
+                # the simulation is running: the header stays the same but the length changed
+                log.debug(f"{path} was modified since the last update")
+                info = {k: v for k, v in info.items() if k not in ("nstep", "ns")}
+                info["stat"] = key
+            with self.lock:
+                self.entries[path] = info
+        return info
+
+
+    def header(self, path):
+        """Returns the info on a mdout file, without checking if it was modified when it is already known.
+        The header of a file only changes when it is rewritten, which is detected by the monitor"""
+        info = self.entries.get(path)
+        return self.get(path) if info is None else info
+
+
+    def length(self, path):
+        """Returns the last step and the length (in ns) of a MD simulation, or None if no step was written"""
+        info = self.get(path)
+        if "nstep" not in info:
+            record = last_record(path)
+            nstep = record[0] if record else None
+            ns = record[0] * info.get("dt", 0.002) * 1e-3 if record else None
+            with self.lock:
+                # unless the file was modified in the meantime
+                if self.entries.get(path) is info:
+                    self.entries[path] = dict(info, nstep=nstep, ns=ns)
+            return nstep, ns
+        return info["nstep"], info["ns"]
+
+
+def parse_mdinfo(text, is_min=False):
+    """Parse the content of a mdinfo file. Returns a dictionary with the last record (a tuple with one
+    value per MDOUT_KEYS, or None), and the steps, speed (ns/day) and time left if they were found"""
+    info = {"record": None}
+    data = parse_records(text, is_min)
+    if len(data):
+        record = data[-1].tolist()
+        record[0] = int(record[0])
+        info["record"] = tuple(record)
+    steps = MDINFO_STEPS.search(text)
+    if steps:
+        info["steps"] = tuple(int(value) for value in steps.groups())
+    speed = MDINFO_SPEED.search(text)
+    if speed:
+        info["speed"] = float(speed.group(1))
+    time_left = MDINFO_TIME_LEFT.search(text)
+    if time_left:
+        info["time_left"] = time_left.group(1).decode(errors="replace")
+    return info
+
+
+class MdinfoReader:
+    """Parser of a mdinfo file, which is only read again when its size or modification time change"""
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.info = None
+
+
+    def read(self, is_min=False, stat=None):
+        """Returns the info of the mdinfo file (see parse_mdinfo) and its modification time,
+        or None if there's no mdinfo file"""
+        try:
+            if stat is None:
+                stat = os.stat(self.path)
+            key = (stat.st_size, stat.st_mtime_ns, is_min)
+            if key == self.key:
+                return self.info
+            log.debug(f"Parsing {self.path}")
+            with open(self.path, "rb") as f:
+                text = f.read()
+        except FileNotFoundError:
+            self.key, self.info = None, None
+            return None
+        self.info = dict(parse_mdinfo(text, is_min), update_time=stat.st_mtime)
+        self.key = key
+        return self.info
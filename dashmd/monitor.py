@@ -0,0 +1,263 @@
+import os, time, logging
+from collections import OrderedDict
+from functools import partial
+from itertools import islice
+from weakref import WeakValueDictionary
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+from .utils import pretty_time, timer, max_workers
+from .mdout import MdoutReader, MdoutInfo, MdinfoReader
+from .structure import read_structure
+from .watcher import start_watcher
+from .directory import DirectorySnapshot
+
+log = logging.getLogger("dashmd")
+
+# files are read and parsed in threads to keep the server responsive
+executor = ThreadPoolExecutor(max_workers=max_workers)
+
+# when watching for changes, delay (in seconds) between the first change and the update, so that
+# a burst of writes triggers only one update
+DEBOUNCE = 1
+# when watching for changes, the directory is still read regularly to refresh the time of the last update
+HEARTBEAT = 60
+
+# monitors of the MD directories opened by at least one session
+monitors = WeakValueDictionary()
+
+
+def get_monitor(md_dir):
+    """Returns the monitor shared by all the sessions opening the same MD directory"""
+    key = os.path.realpath(md_dir)
+    monitor = monitors.get(key)
+    if monitor is None:
+        monitor = DirectoryMonitor(md_dir)
+        monitors[key] = monitor
+    return monitor
+
+
+class DirectoryMonitor:
+    """Reads the files of a MD directory once per update, and sends the result to all the
+    sessions subscribed to it. The directory is only polled while at least one session is subscribed"""
+    def __init__(self, md_dir):
+        self.md_dir = md_dir
+        # dashboards that receive the updates
+        self.subscribers = set()
+        self.callback = None
+        # watcher of the file changes (None when polling), and the update waiting for more changes
+        self.watcher = None
+        self.io_loop = None
+        self.pending_update = None
+        # True while the files are being read, True if files changed in the meantime,
+        # and duration of each step of the last update
+        self.updating = False
+        self.outdated = False
+        self.timings = OrderedDict()
+        # info about simulation files (min, dt, rst and mdcrd files, length)
+        self.mdout_info = MdoutInfo()
+        self.mdinfo_reader = MdinfoReader(os.path.join(md_dir, "mdinfo"))
+        # readers of the mdout files plotted by the sessions, kept as long as a session plots them
+        self.readers = WeakValueDictionary()
+        # structures of the restart files viewed automatically, and their modification time
+        self.structures = {}
+        # files of the directory listed during the last update
+        self.last_snapshot = None
+
+
+    def subscribe(self, dashboard, update, watch=False):
+        """Send the updates to a dashboard, polling the directory every `update` seconds,
+        or as soon as a file changes if `watch` is True and the changes can be detected"""
+        self.subscribers.add(dashboard)
+        log.debug(f"{len(self.subscribers)} session(s) watching {self.md_dir}")
+        self.io_loop = IOLoop.current()
+        if (self.watcher is None) and watch:
+            self.watcher = start_watcher(self.md_dir, self.file_changed)
+            if self.watcher is not None:
+                update = max(update, HEARTBEAT)
+                if self.callback is not None:
+                    self.callback.stop()
+                    self.callback = None
+        if self.callback is None:
+            log.debug(f"Start reading {self.md_dir} every {update} seconds")
+            self.callback = PeriodicCallback(self.update, update*1e3)
+            self.callback.start()
+        # first update of the new session
+        self.io_loop.add_callback(self.update)
+
+
+    def unsubscribe(self, dashboard):
+        """Stop sending the updates to a dashboard, and stop polling if it was the last one"""
+        self.subscribers.discard(dashboard)
+        log.debug(f"{len(self.subscribers)} session(s) watching {self.md_dir}")
+        if (not self.subscribers) and (self.callback is not None):
+            log.debug(f"Stop watching {self.md_dir}")
+            self.callback.stop()
+            self.callback = None
+            if self.watcher is not None:
+                self.watcher.stop()
+                self.watcher = None
+            if self.pending_update is not None:
+                self.io_loop.remove_timeout(self.pending_update)
+                self.pending_update = None
+            self.structures.clear()
+
+
+    def file_changed(self, filename):
+        """Called from the thread of the watcher when a file changes"""
+        log.debug(f"{filename} changed in {self.md_dir}")
+        self.io_loop.add_callback(self.schedule_update)
+
+
+    def schedule_update(self):
+        """Update after a short delay, unless an update is already scheduled"""
+        if self.pending_update is None:
+            self.pending_update = self.io_loop.call_later(DEBOUNCE, self.debounced_update)
+
+
+    def debounced_update(self):
+        """Update triggered by file changes"""
+        self.pending_update = None
+        self.update(coalesce=True)
+
+
+    def reader(self, mdout, is_min=False):
+        """Returns the reader of a mdout file, shared by all the sessions plotting it"""
+        path = os.path.join(self.md_dir, mdout)
+        reader = self.readers.get(path)
+        if (reader is None) or (reader.is_min != is_min):
+            reader = MdoutReader(path, is_min=is_min)
+            # restore what was parsed during a previous session
+            reader.load_cache()
+            self.readers[path] = reader
+        return reader
+
+
+    def is_min(self, mdout):
+        """Returns True if minimization, False if MD, None if the 'imin' keyword was not found"""
+        return self.mdout_info.get(os.path.join(self.md_dir, mdout)).get("min", None)
+
+
+    @gen.coroutine
+    def update(self, coalesce=False):
+        """Read the new data in a thread, then update the documents of the subscribed sessions.
+        If the previous update is still running, the update is skipped, or done once it is finished
+        if `coalesce` is True (files changed since the previous update started reading them)"""
+        if not self.subscribers:
+            return
+        if self.updating:
+            if coalesce:
+                log.debug(f"The previous update of {self.md_dir} is still running, it will be followed by another one")
+                self.outdated = True
+            else:
+                log.debug(f"The previous update of {self.md_dir} is still running, skipping this one")
+            return
+        self.updating = True
+        log.debug(f"Starting update of {self.md_dir}")
+        # what the sessions display is read here, the widgets should not be accessed from the thread
+        n_simulations = max(dashboard.slider.value for dashboard in self.subscribers)
+        views = {dashboard.autoview_files() for dashboard in self.subscribers} - {None}
+        try:
+            updates = yield executor.submit(self.read_updates, n_simulations, views)
+        except Exception:
+            log.exception(f"Could not read the data of {self.md_dir}")
+            return
+        finally:
+            self.updating = False
+            if self.outdated:
+                self.outdated = False
+                self.io_loop.add_callback(self.update, coalesce=True)
+        self.timings = updates["timings"]
+        log.debug(f"Sending the updates of {self.md_dir} to {len(self.subscribers)} session(s)")
+        for dashboard in list(self.subscribers):
+            dashboard.doc.add_next_tick_callback(partial(dashboard.apply_updates, updates))
+
+
+    def read_updates(self, n_simulations, views):
+        """Read and parse all the files needed to update the dashboards"""
+        updates = {"timings": OrderedDict()}
+        timings = updates["timings"]
+        with timer(timings, "mdout files"):
+            # the directory is listed once per update, for all the readers and sessions
+            snapshot = self.snapshot(max_age=0)
+            updates["snapshot"] = snapshot
+            updates["mdout_files"] = self.latest_mdout_files(snapshot)
+        with timer(timings, "mdinfo"):
+            updates["mdinfo"] = self.read_mdinfo(updates["mdout_files"], snapshot)
+        with timer(timings, "simulations length"):
+            updates["simulations_length"] = self.read_simulations_length(updates["mdout_files"], n_simulations)
+        with timer(timings, "mdout"):
+            for reader in list(self.readers.values()):
+                reader.read()
+                # the records of the finished simulations are saved once
+                if reader.finished:
+                    reader.save_cache()
+        with timer(timings, "structure"):
+            for rst, top in views:
+                try:
+                    self.read_autoview_structure(rst, top, snapshot)
+                except Exception:
+                    log.exception(f"Could not read restart {rst} with topology {top}")
+            updates["structures"] = dict(self.structures)
+        return updates
+
+
+    def snapshot(self, max_age=1):
+        """Returns the files of the MD directory, listed again if the last listing is older than `max_age` seconds"""
+        snapshot = self.last_snapshot
+        if (snapshot is None) or (time.time() - snapshot.time > max_age):
+            snapshot = DirectorySnapshot(self.md_dir)
+            self.last_snapshot = snapshot
+        return snapshot
+
+
+    def latest_mdout_files(self, snapshot=None):
+        """List all mdout files present in the MD directory, sorted by modification time"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        return list(snapshot.mdout)
+
+
+    def read_mdinfo(self, mdout_files, snapshot=None):
+        """Parse the mdinfo file, returns a dictionary with the info to display, or None if there's no mdinfo"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        # min or md
+        latest_mdout_file = mdout_files[0] if mdout_files else None
+        is_min = bool(latest_mdout_file and self.is_min(latest_mdout_file))
+        stat = snapshot.stat("mdinfo")
+        info = self.mdinfo_reader.read(is_min, stat) if stat is not None else None
+        if info is None:
+            log.error(f"No mdinfo file in {self.md_dir}")
+            return None
+        mdinfo = dict(info, latest_mdout_file=latest_mdout_file)
+        if "time_left" in mdinfo:
+            mdinfo["time_left"] = pretty_time(mdinfo["time_left"])
+        return mdinfo
+
+
+    def read_simulations_length(self, mdout_files, n_simulations):
+        """Returns the length (in ns) of the `n_simulations` latest MD simulations"""
+        log.debug("Computing total time of simulation(s) displayed")
+        current_time = OrderedDict()
+        # discard min files and limit to the most recent MD files
+        md_files = (f for f in mdout_files if not self.is_min(f))
+        for mdout in islice(md_files, n_simulations):
+            _, ns = self.mdout_info.length(os.path.join(self.md_dir, mdout))
+            if ns is not None:
+                current_time[mdout] = ns
+        return current_time
+
+
+    def read_autoview_structure(self, rst, top, snapshot=None):
+        """Read the restart file if it has been modified since it was last read"""
+        if snapshot is None:
+            snapshot = self.snapshot()
+        update_time = snapshot.mtime(rst)
+        cached = self.structures.get((rst, top))
+        if (cached is None) or (update_time > cached[0]):
+            log.debug(f"Updating {rst} with more recent version: {update_time}")
+            structure = read_structure(os.path.join(self.md_dir, rst), os.path.join(self.md_dir, top))
+            self.structures[(rst, top)] = (update_time, structure)
+        else:
+            log.debug(f"No recent update of restart {rst}")
@@ -0,0 +1,100 @@
+import logging
+from functools import partial
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import (
+    TextInput, Button, Div, DataTable, TableColumn, NumberFormatter, HTMLTemplateFormatter,
+)
+from .fleet import get_fleet, local_time, executor, FLEET_RATE
+from .utils import pretty_time
+
+log = logging.getLogger("dashmd")
+
+COLUMNS = ["directory", "progress", "speed", "time_left", "update_time", "temperature", "sparkline"]
+
+
+class FleetOverview:
+    """Summary table of the progress of all the MD directories below a root directory or glob"""
+    def __init__(self, doc, update=20, rate=FLEET_RATE, root=None):
+        self.doc = doc
+        self.update_rate = update
+        self.rate = rate
+        self.root = TextInput(title="Root directory or glob of the MD directories", value=root or "", width=650)
+        self.scan_button = Button(width=80, height=50, label="Scan", button_type="primary")
+        self.status = Div(width=750, text="")
+        self.source = ColumnDataSource({column: [] for column in COLUMNS})
+        self.table = DataTable(source=self.source, width=1000, height=600, sortable=True, columns=[
+            TableColumn(field="directory", title="Directory", width=400),
+            TableColumn(field="progress", title="Progress (%)", formatter=NumberFormatter(format="0.0"), width=90),
+            TableColumn(field="speed", title="ns/day", formatter=NumberFormatter(format="0.00"), width=70),
+            TableColumn(field="time_left", title="Time remaining", width=160),
+            TableColumn(field="update_time", title="Last update", width=120),
+            TableColumn(field="temperature", title="Temperature (K)", formatter=NumberFormatter(format="0.0"), width=100),
+            TableColumn(field="sparkline", title="ns/day history", formatter=HTMLTemplateFormatter(template="<%= value %>"), width=110),
+        ])
+        # fleet shared with the other sessions, regular poll, and True while the files are being read
+        self.fleet = None
+        self.callback = None
+        self.polling = False
+        self.scan_button.on_click(self.scan)
+        if root:
+            self.scan()
+
+
+    def scan(self):
+        """Follow the MD directories of the root directory or glob"""
+        root = self.root.value.strip()
+        if not root:
+            return
+        log.debug(f"Following the MD directories of {root}")
+        self.fleet = get_fleet(root, self.rate)
+        self.source.data = {column: [] for column in COLUMNS}
+        if self.callback is None:
+            self.callback = self.doc.add_periodic_callback(self.update, self.update_rate * 1e3)
+        self.update()
+
+
+    def update(self):
+        """Check the mdinfo files in a thread, unless the previous check is still running"""
+        if (self.fleet is None) or self.polling:
+            return
+        self.polling = True
+        executor.submit(self.poll, self.fleet)
+
+
+    def poll(self, fleet):
+        """Read the mdinfo files allowed by the I/O budget (in a thread)"""
+        try:
+            rows = fleet.poll()
+        except Exception:
+            log.exception(f"Could not read the MD directories of {fleet.root}")
+            rows = None
+        self.doc.add_next_tick_callback(partial(self.show_rows, fleet, rows))
+
+
+    def show_rows(self, fleet, rows):
+        """Display the summary of the MD directories"""
+        self.polling = False
+        if (fleet is not self.fleet) or (rows is None):
+            return
+        data = {column: [] for column in COLUMNS}
+        for row in rows:
+            for column in COLUMNS:
+                value = row[column]
+                if column == "time_left":
+                    value = pretty_time(value) if value else ""
+                elif column == "update_time":
+                    # formatted here since the DateFormatter displays UTC times
+                    value = local_time(value)
+                elif value is None:
+                    value = "" if column in ("directory", "sparkline") else float("nan")
+                data[column].append(value)
+        self.source.data = data
+        self.status.text = f"{len(rows)} MD directories"
+
+
+    def stop(self):
+        """Stop following the MD directories"""
+        if self.callback is not None:
+            self.doc.remove_periodic_callback(self.callback)
+            self.callback = None
+        self.fleet = None
@@ -1,7 +1,11 @@
-// load and display
-var stringBlob = new Blob( [ "%s" ], { type: "text/plain" } );
-// save some components to be restored
-var orientation = stage.viewerControls.getOrientation();
+// coordinates of the atoms (float32, in the order of the topology) sent by the server
+var xyz = coords.data["xyz"];
+if (xyz.length == 0) {
+  return;
+}
+// the topology is only sent when it changes, the PDB data is kept here
+var key = topology.data["key"][0];
+var pdb = topology.data["pdb"][0];
 // store which representations to activate
 var show_repr = {
   0: 0,
@@ -13,10 +17,24 @@ var show_repr = {
 for (i in repr.active) {
   show_repr[repr.active[i]] = 1;
 }
+// the server increments the tags of the coordinates when the structure must be rebuilt
+var settings = JSON.stringify([key, show_repr, ligand_mask.value, coords.tags]);
+// same structure and representations: only move the atoms
+if (stage.dashmd_component && (stage.dashmd_settings == settings)) {
+  stage.dashmd_component.structure.updatePosition(xyz);
+  stage.dashmd_component.updateRepresentations({ position: true });
+  return;
+}
+var stringBlob = new Blob( [ pdb ], { type: "text/plain" } );
+// save some components to be restored
+var orientation = stage.viewerControls.getOrientation();
 // clean stage
 stage.removeAllComponents();
+stage.dashmd_component = null;
 // load structure
 stage.loadFile(stringBlob, { ext: "pdb" } ).then(function (o) {
+  // use the coordinates of the restart file
+  o.structure.updatePosition(xyz);
   // protein
   if (show_repr[0]) {
     o.addRepresentation("cartoon", {
@@ -55,4 +73,7 @@ stage.loadFile(stringBlob, { ext: "pdb" } ).then(function (o) {
 
   o.autoView();
   stage.viewerControls.orient(orientation);
+  // kept to update the positions of the atoms when the restart file changes
+  stage.dashmd_component = o;
+  stage.dashmd_settings = settings;
 });
@@ -0,0 +1,249 @@
+import os, re, zlib, logging, threading
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+import numpy as np
+import pytraj as pt
+from .analysis import PROTEIN_RESIDUES
+from .topology import load_topology
+
+log = logging.getLogger("dashmd")
+
+WATER_RESIDUES = ["WAT", "HOH", "H2O", "SOL", "TIP3", "TIP4", "TIP5", "T3P", "T4P", "SPC", "SPCE", "OPC"]
+ION_RESIDUES = [
+    "Na+", "K+", "Cl-", "Li+", "Rb+", "Cs+", "Mg+", "Ca+", "Zn+", "Br-", "F-", "I-",
+    "NA", "K", "CL", "LI", "MG", "CA", "ZN", "SOD", "POT", "CLA", "CAL",
+]
+# categories of atoms, in the order of the representations of the View tab
+CATEGORIES = ["protein", "ligand", "water", "lipid", "ion"]
+
+# topologies of the last restart files read: PDB data used by NGL for the atoms, residues and bonds,
+# and the atoms of each category
+topology_pdbs = OrderedDict()
+max_topology_pdbs = 4
+# frames of a trajectory kept in memory when scrubbing through it, and frames read at once
+MAX_FRAMES = 128
+PREFETCH_FRAMES = 16
+# restart files are read from the update threads and from the View button
+topology_lock = threading.Lock()
+
+
+def topology_key(top_path):
+    """Identifies a topology file and its version"""
+    return f"{os.path.realpath(top_path)}:{os.stat(top_path).st_mtime_ns}"
+
+
+def to_pdb(traj):
+    """Convert a pytraj trajectory to PDB data"""
+    # write as pdb to temporary file (much faster than parmed + StringIO)
+    with NamedTemporaryFile(suffix=".pdb") as f:
+        pt.write_traj(f.name, traj, format="pdb", overwrite=True)
+        return f.read()
+
+
+def parse_pdb(key, pdb):
+    """Split the PDB data of a topology into atoms, and assign each atom to a residue and a category"""
+    atoms, ter = [], []
+    residues, residue_names = [], []
+    previous = None
+    for line in pdb.splitlines(keepends=True):
+        if line.startswith((b"ATOM", b"HETATM")):
+            atoms.append(line)
+            name = line[17:21].strip().decode()
+            # a residue starts when the residue name or number changes, or after a TER record
+            residue = line[17:27]
+            if residue != previous:
+                residue_names.append(name)
+                previous = residue
+            residues.append(len(residue_names) - 1)
+        elif line.startswith(b"TER"):
+            ter.append(len(atoms) - 1)
+            previous = None
+    names = np.array(residue_names, dtype=str)[np.array(residues, dtype=np.int64)]
+    protein = np.isin(names, PROTEIN_RESIDUES)
+    water = np.isin(names, WATER_RESIDUES)
+    ion = np.isin(names, ION_RESIDUES)
+    return {
+        "key": key,
+        "pdb": pdb,
+        "atoms": atoms,
+        "ter": set(ter),
+        "residues": np.array(residues, dtype=np.int64),
+        "names": names,
+        # ligands and lipids are only separated by the ligand name chosen when selecting the atoms
+        "categories": {"protein": protein, "water": water, "ion": ion, "other": ~(protein | water | ion)},
+    }
+
+
+def select_atoms(topology, coords, representations, ligand="LIG", shell=0):
+    """Returns the indices of the atoms needed by the active representations (indices of `CATEGORIES`),
+    or None if all the atoms are needed. If `shell` is positive, only the water molecules within
+    `shell` Å of the protein and ligand are kept"""
+    categories = topology["categories"]
+    # residue names that are part of the NGL selection of the ligand
+    ligand_names = {word.upper() for word in re.findall(r"[\w+-]+", ligand)} - {"AND", "OR", "NOT"}
+    is_ligand = categories["other"] & np.isin(np.char.upper(topology["names"]), list(ligand_names))
+    if not is_ligand.any():
+        # the ligand may be selected with a more complex NGL selection, keep everything that could match
+        is_ligand = categories["other"]
+    masks = {
+        "protein": categories["protein"],
+        "ligand": is_ligand,
+        "water": categories["water"],
+        "lipid": categories["other"] & ~is_ligand,
+        "ion": categories["ion"],
+    }
+    active = [CATEGORIES[i] for i in representations]
+    if (len(active) == len(CATEGORIES)) and (shell <= 0):
+        return None
+    selected = np.zeros(len(topology["atoms"]), dtype=bool)
+    for category in active:
+        if category != "water":
+            selected |= masks[category]
+    if "water" in active:
+        if shell > 0:
+            selected |= water_shell(topology, coords, masks["protein"] | masks["ligand"], shell)
+        else:
+            selected |= masks["water"]
+    return np.flatnonzero(selected)
+
+
+def water_shell(topology, coords, solute, shell, chunksize=1024):
+    """Returns a mask of the atoms of the water molecules with at least one atom within `shell` Å of the solute"""
+    water = topology["categories"]["water"]
+    xyz = coords.reshape(-1, 3)
+    solute_xyz = xyz[solute]
+    if not len(solute_xyz):
+        return water
+    water_indices = np.flatnonzero(water)
+    close = np.zeros(len(water_indices), dtype=bool)
+    # compare the water atoms with the solute by chunks to limit the memory used
+    lower, upper = solute_xyz.min(axis=0) - shell, solute_xyz.max(axis=0) + shell
+    for start in range(0, len(water_indices), chunksize):
+        indices = water_indices[start:start+chunksize]
+        chunk = xyz[indices]
+        # skip the atoms outside of the box around the solute
+        inside = np.flatnonzero(np.all((chunk >= lower) & (chunk <= upper), axis=1))
+        if not len(inside):
+            continue
+        d2 = ((chunk[inside, None, :] - solute_xyz[None, :, :])**2).sum(axis=2)
+        close[start + inside] = d2.min(axis=1) <= shell**2
+    # keep the whole water molecules
+    residues = topology["residues"]
+    selected = np.isin(residues, residues[water_indices[close]])
+    return selected & water
+
+
+def selection_key(topology, atoms):
+    """Identifies a subset of the atoms of a topology"""
+    if atoms is None:
+        return topology["key"]
+    return f"{topology['key']}:{len(atoms)}:{zlib.crc32(atoms.tobytes()):08x}"
+
+
+def subset_pdb(topology, atoms):
+    """Returns the PDB data of a subset of the atoms of a topology"""
+    if atoms is None:
+        return topology["pdb"]
+    lines = []
+    for i in atoms:
+        lines.append(topology["atoms"][i])
+        if i in topology["ter"]:
+            lines.append(b"TER\n")
+    lines.append(b"END\n")
+    return b"".join(lines)
+
+
+def topology_pdb(top_path, traj):
+    """Returns the topology (see `parse_pdb`) of a trajectory for NGL, converted once per topology file"""
+    key = topology_key(top_path)
+    with topology_lock:
+        if key in topology_pdbs:
+            topology_pdbs.move_to_end(key)
+        else:
+            log.debug(f"Converting topology {top_path} to PDB")
+            topology_pdbs[key] = parse_pdb(key, to_pdb(traj[:1]))
+            if len(topology_pdbs) > max_topology_pdbs:
+                topology_pdbs.popitem(last=False)
+        return topology_pdbs[key]
+
+
+def read_structure(rst_path, top_path):
+    """Read a restart file for NGL. Returns a dictionary with the topology (see `parse_pdb`),
+    and the coordinates of the atoms as a flat float32 array"""
+    log.debug(f"Reading restart {rst_path} with topology {top_path}")
+    # load rst7 with pytraj (NGL cannot read it directly)
+    traj = pt.load(rst_path, load_topology(top_path))
+    traj = pt.autoimage(traj)
+    return {
+        "topology": topology_pdb(top_path, traj),
+        "coords": traj.xyz[0].astype(np.float32).ravel(),
+    }
+
+
+class FrameReader:
+    """Random access to the frames of trajectories for NGL. Frames are read by chunks of the next
+    `prefetch` frames, and the last `max_frames` frames read are kept in memory"""
+    def __init__(self, top_path, trajectories, max_frames=MAX_FRAMES, prefetch=PREFETCH_FRAMES):
+        self.top_path = top_path
+        self.trajectories = list(trajectories)
+        self.max_frames = max_frames
+        self.prefetch = prefetch
+        self.traj = pt.iterload(self.trajectories, load_topology(top_path))
+        self.n_frames = self.traj.n_frames
+        self.topology = None
+        # coordinates of the frames, from the least to the most recently used
+        self.frames = OrderedDict()
+        # the frames in memory are accessed from the threads of the dashboard and the IOLoop, which
+        # never waits for the trajectory to be read by another thread
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+
+
+    def cached(self, index):
+        """Returns the structure of a frame if it is in memory, else None"""
+        with self.lock:
+            if index not in self.frames:
+                return None
+            self.frames.move_to_end(index)
+            return {"topology": self.topology, "coords": self.frames[index]}
+
+
+    def frame(self, index):
+        """Returns the structure of a frame (see `read_structure`), reading the next frames at the same time"""
+        structure = self.cached(index)
+        if structure is None:
+            self.read(index)
+            structure = self.cached(index)
+        return structure
+
+
+    def read_ahead(self, index):
+        """Read the frames following `index` that are not in memory yet"""
+        stop = min(index + self.prefetch, self.n_frames)
+        with self.lock:
+            missing = [i for i in range(index, stop) if i not in self.frames]
+        if missing:
+            self.read(missing[0])
+
+
+    def read(self, start):
+        """Read consecutive frames from `start`"""
+        with self.io_lock:
+            with self.lock:
+                if start in self.frames:
+                    # read by another thread in the meantime
+                    return
+                stop = min(start + self.prefetch, self.n_frames)
+                # don't read again the frames already in memory
+                stop = next((i for i in range(start + 1, stop) if i in self.frames), stop)
+            log.debug(f"Reading frames {start} to {stop} of {self.trajectories}")
+            traj = pt.autoimage(self.traj[start:stop])
+            topology = self.topology or topology_pdb(self.top_path, traj)
+            xyz = traj.xyz.astype(np.float32)
+            with self.lock:
+                self.topology = topology
+                for i, coords in enumerate(xyz, start):
+                    self.frames[i] = coords.ravel()
+                    self.frames.move_to_end(i)
+                while len(self.frames) > self.max_frames:
+                    self.frames.popitem(last=False)
@@ -0,0 +1,65 @@
+import os, logging, threading
+from collections import OrderedDict
+import numpy as np
+import pytraj as pt
+
+log = logging.getLogger("dashmd")
+
+# memory (in bytes) allowed for the topologies kept in memory, estimated from the size of their files
+max_topology_memory = int(os.environ.get("DASHMD_TOPOLOGY_MEMORY", 512 * 2**20))
+# number of atom selections kept for each topology
+max_masks = 64
+
+# parsed topologies, from the least to the most recently used
+topologies = OrderedDict()
+topology_lock = threading.Lock()
+
+
+def topology_memory(path):
+    """Estimate the memory used by a parsed topology"""
+    return 2 * os.path.getsize(path)
+
+
+def get_topology(path):
+    """Returns the entry of the cache for a topology file, parsing the file if it was modified"""
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_mtime_ns)
+    with topology_lock:
+        entry = topologies.get(key)
+        if entry is not None:
+            topologies.move_to_end(key)
+            return entry
+        log.debug(f"Parsing topology {path}")
+        entry = {"topology": pt.load_topology(path), "memory": topology_memory(path), "masks": OrderedDict()}
+        # forget the previous versions of the file
+        for other in [k for k in topologies if k[0] == key[0]]:
+            del topologies[other]
+        topologies[key] = entry
+        # the topology that was just parsed is kept even if it is over the budget
+        while (len(topologies) > 1) and (sum(e["memory"] for e in topologies.values()) > max_topology_memory):
+            old_key, _ = topologies.popitem(last=False)
+            log.debug(f"Removing topology {old_key[0]} from memory")
+        return entry
+
+
+def load_topology(path):
+    """Returns the pytraj topology of a file, shared by all the sessions and parsed once per modification"""
+    return get_topology(path)["topology"]
+
+
+def atom_indices(path, mask):
+    """Returns the indices of the atoms of a topology file selected by a mask"""
+    entry = get_topology(path)
+    masks = entry["masks"]
+    with topology_lock:
+        if mask in masks:
+            masks.move_to_end(mask)
+            return masks[mask]
+    indices = np.asarray(entry["topology"].atom_indices(mask))
+    # the array is shared, it should not be modified
+    indices.setflags(write=False)
+    with topology_lock:
+        masks[mask] = indices
+        if len(masks) > max_masks:
+            masks.popitem(last=False)
+    return indices
@@ -1,5 +1,6 @@
-import os, logging, copy, re, socket
+import os, logging, copy, re, socket, time
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 from multiprocessing import cpu_count
 import numpy as np
 from bokeh.models import HoverTool
@@ -37,6 +38,10 @@ empty_mddata_dic = {k:[] for k in [
     "Etot", "EKtot", "EPtot",
     "Volume", "Density",
 ]}
+# data smoothed with a moving average
+moving_avg_keys = ["Temperature", "Pressure", "Volume", "Density"]
+# empty dictionary for the plotted MD data
+empty_mdplot_dic = {**empty_mddata_dic, **{f"{k}_avg":[] for k in moving_avg_keys}}
 # help for the controls
 NGL_HELP_TEXT = """
 scroll: zoom scene
@@ -75,59 +80,38 @@ for handler in tornado_logger.handlers:
     handler.addFilter(TornadoFilter())
 
 
-def readlines_reverse(filename):
-    """Generator that reads a file from end to begining"""
-    with open(filename) as qfile:
-        qfile.seek(0, os.SEEK_END)
-        position = qfile.tell()
-        line = ''
-        while position >= 0:
-            qfile.seek(position)
-            next_char = qfile.read(1)
-            if next_char == "\n":
-                yield line[::-1]
-                line = ''
-            else:
-                line += next_char
-            position -= 1
-        yield line[::-1]
+class MovingAverage:
+    """Moving average of a series over `window` points, updated as new points are added"""
+    def __init__(self, window):
+        self.window = window
+        # last points of the previous update, needed for the next windows
+        self.tail = np.empty(0)
+        # moving average for all the points added so far
+        self.values = np.empty(0)
 
 
-# JS function to compute the moving average on 10% of total points
-moving_avg_func = """
-    function movingAvg(array, count, qualifier){
+    def update(self, values):
+        """Add new points and returns their moving average"""
+        data = np.concatenate([self.tail, np.asarray(values, dtype=float)])
+        cumsum = np.concatenate([[0], np.cumsum(data)])
+        ends = np.arange(len(self.tail) + 1, len(data) + 1)
+        # the first points are averaged over the points available
+        starts = np.maximum(ends - self.window, 0)
+        avg = (cumsum[ends] - cumsum[starts]) / (ends - starts)
+        self.tail = data[len(data) - self.window + 1:] if self.window > 1 else np.empty(0)
+        self.values = np.concatenate([self.values, avg])
+        return avg
 
-        // calculate average for subarray
-        var avg = function(array, qualifier){
-            var sum = 0, count = 0, val;
-            for (var i in array){
-                val = array[i];
-                if (!qualifier || qualifier(val)){
-                    sum += val;
-                    count++;
-                }
-            }
-            return sum / count;
-        };
 
-        var result = [], val;
+@contextmanager
+def timer(timings, name):
+    """Context manager that stores the time spent in the block in timings[name]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
 
-        // calculate average for each subarray and add to result
-        for (var i=0, len=array.length - count; i <= len; i++){
-            val = avg(array.slice(i, i + count), qualifier);
-            if (!isNaN(val)){
-                result.push(val);
-            }
-        }
-        return result;
-    }
-
-    if (xs.length < 200)
-        return xs;
-    else
-        var count = Math.round(0.1 * xs.length);
-        return movingAvg(xs, count);
-"""
 
 # colors
 def clamp(val, minimum=0, maximum=255):
@@ -173,11 +157,6 @@ def get_stepsize(traj, min_points=200):
         return n // min_points
 
 
-def compute_rmsd(frame, ref):
-    """Compute RMSD between a reference and a frame"""
-    return ref.rmsd(frame)
-
-
 def parse_md_data(line):
     """Parse data from a MD simulation mdout file"""
     data = copy.deepcopy(empty_mddata_dic)
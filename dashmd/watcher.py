@@ -0,0 +1,127 @@
+import os, re, select, struct, logging, threading
+import ctypes, ctypes.util
+
+log = logging.getLogger("dashmd")
+
+# files that trigger an update of the dashboard when they change
+WATCHED_FILES = re.compile(r'^mdinfo$|.+\.(md)?out$|.+\.rst7?$')
+
+# inotify events, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_NONBLOCK = os.O_NONBLOCK
+# wd, mask, cookie, len, followed by the name of the file
+IN_EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchdogWatcher:
+    """Calls `callback(filename)` when a watched file of the directory changes, using watchdog"""
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.observer = None
+
+
+    def start(self):
+        """Start watching, raises ImportError if watchdog is not installed"""
+        from watchdog.observers import Observer
+        self.observer = Observer()
+        # the watcher is used as the event handler
+        self.observer.schedule(self, self.path, recursive=False)
+        self.observer.daemon = True
+        self.observer.start()
+
+
+    def dispatch(self, event):
+        """Receives the events of watchdog"""
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path and WATCHED_FILES.match(os.path.basename(path)):
+                self.callback(os.path.basename(path))
+
+
+    def stop(self):
+        """Stop watching the directory"""
+        self.observer.stop()
+        self.observer.join()
+
+
+class InotifyWatcher:
+    """Calls `callback(filename)` when a watched file of the directory changes, using inotify through ctypes"""
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.fd = None
+        # pipe used to wake up the thread when stopping
+        self.stop_pipe = None
+        self.thread = None
+
+
+    def start(self):
+        """Start watching, raises OSError if inotify is not available"""
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(self.path), IN_EVENTS) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {self.path}")
+        self.stop_pipe = os.pipe()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def run(self):
+        """Read the inotify events until the watcher is stopped"""
+        while True:
+            ready, _, _ = select.select([self.fd, self.stop_pipe[0]], [], [])
+            if self.stop_pipe[0] in ready:
+                break
+            try:
+                buffer = os.read(self.fd, 64*1024)
+            except BlockingIOError:
+                continue
+            names = set()
+            position = 0
+            while position < len(buffer):
+                _, _, _, length = IN_EVENT_HEADER.unpack_from(buffer, position)
+                position += IN_EVENT_HEADER.size
+                name = buffer[position:position + length].rstrip(b"\0").decode(errors="replace")
+                position += length
+                if WATCHED_FILES.match(name):
+                    names.add(name)
+            for name in names:
+                self.callback(name)
+        for fd in (self.fd, *self.stop_pipe):
+            os.close(fd)
+
+
+    def stop(self):
+        """Stop watching the directory"""
+        os.write(self.stop_pipe[1], b"\0")
+        self.thread.join()
+
+
+def start_watcher(path, callback):
+    """Watch the mdinfo, mdout and restart files of a directory, with watchdog or else inotify.
+    Returns the watcher, or None if the changes cannot be detected (the directory should be polled instead)"""
+    for watcher_class in (WatchdogWatcher, InotifyWatcher):
+        watcher = watcher_class(path, callback)
+        try:
+            watcher.start()
+        except (ImportError, OSError) as e:
+            log.debug(f"Cannot watch {path} with {watcher_class.__name__}: {e}")
+            continue
+        log.debug(f"Watching {path} with {watcher_class.__name__}")
+        return watcher
+    log.warning(f"Changes in {path} cannot be detected, falling back to polling")
+    return None